@@ -11,10 +11,11 @@ del get_versions
 from .accessibility.accessibility import run
 from .accessibility.isochrone import Accessibility
 from .classification.classification import ClassificationDataFrames
-from .graph.connectpoints import ConnectPoints
+from .graph.connectpoints import ConnectPoints, apply_delta
 from .graph.splittednodes import GetSplitNodes
 from .graph.utils import graph_to_df, df_to_graph
 from .osmquery.methods import get_OSM_poly
 from .spatialops.operations import SpatialOperations, gdf_to_geosource
 from .spatialops.intersections import GetIntersections
 from .citygml.analyseroofs import GetRoofsAndSlopes
+from .citygml.tiles import GetRoofsAndSlopesTiles
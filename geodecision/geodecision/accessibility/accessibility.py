@@ -28,7 +28,7 @@ from .isochrone import Accessibility
 from ..graph.utils import graph_to_gdf_points, df_to_graph, graph_to_df
 from ..graph.splittednodes import GetSplitNodes
 from ..graph.connectpoints import ConnectPoints
-from ..spatialops.operations import SpatialOperations
+from ..spatialops.operations import SpatialOperations, repair_geometries
 
 #speedups.enable()
 
@@ -192,6 +192,9 @@ def run(json_params):
     gdf_features = gpd.read_file(params["polygons_geojsonfile"])
     #Drop duplicates based on geometry
     gdf_features = gdf_features.drop_duplicates(subset="geometry")
+    #Repair invalid geometries and drop the ones still invalid
+    gdf_features = repair_geometries(gdf_features)
+    gdf_features = gdf_features.loc[gdf_features["validity"]==True]
     gdf_features = gdf_features.to_crs(
             {
                     "init":"epsg:{}".format(
@@ -209,33 +212,6 @@ def run(json_params):
                 )
                 )
     
-    start = time.time()
-    #Split the LineStrings' polygons' boundaries into segments 
-    # (*with a set distance in meters*) in order to create new nodes to 
-    # generate potential connexions (*edges*) to the graph. 
-    polygons_points_metric = GetSplitNodes(
-            gdf_features, 
-            params["dist_split"],
-            params["id_column"]
-            ).get_split_nodes()
-    
-    #Keep only desired columns
-    ## add "unique_id" to the list
-    params["columns_to_keep"].append("unique_id")
-    polygons_points_metric = polygons_points_metric[params["columns_to_keep"]]
-    
-    logger.info(
-        """
-        | get_accessibility.py | 
-        | run |
-        
-        Splitter:
-            Total time : {}
-        """.format(
-            _get_duration(start)
-        )
-    )
-    
     #Import graph from json files and transform to NetworkX MultiDiGraph
     start = time.time()
     G = df_to_graph(
@@ -286,6 +262,41 @@ def run(json_params):
         )
     )
         
+    start = time.time()
+    #Split the LineStrings' polygons' boundaries into segments 
+    # (*with a set distance in meters*) in order to create new nodes to 
+    # generate potential connexions (*edges*) to the graph. 
+    # If network_sampling, only points close enough (threshold) to the
+    # network are kept.
+    if params.get("network_sampling", False):
+        sampling_edges = gdf_lines_metric
+    else:
+        sampling_edges = None
+    polygons_points_metric = GetSplitNodes(
+            gdf_features, 
+            params["dist_split"],
+            params["id_column"],
+            edges=sampling_edges,
+            threshold=params["threshold"]
+            ).get_split_nodes()
+    
+    #Keep only desired columns
+    ## add "unique_id" and "part_id" to the list
+    params["columns_to_keep"].extend(["unique_id", "part_id"])
+    polygons_points_metric = polygons_points_metric[params["columns_to_keep"]]
+    
+    logger.info(
+        """
+        | get_accessibility.py | 
+        | run |
+        
+        Splitter:
+            Total time : {}
+        """.format(
+            _get_duration(start)
+        )
+    )
+    
     start = time.time()
     #Get the updated nodes and edges (nodes from splitting polygons exterior
     # LineStrings)
@@ -300,7 +311,10 @@ def run(json_params):
             path = None,
             threshold= params["threshold"], 
             knn=params["knn"],
-            distance=params["distance"]
+            distance=params["distance"],
+            merge_distance=params.get("merge_distance"),
+            workers=params.get("workers", 1),
+            tile_size=params.get("tile_size")
         ).process()
     
     logger.info(
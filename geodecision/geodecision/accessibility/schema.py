@@ -84,8 +84,16 @@ ACCESS_SCHEMA = {
                     {"type" : "integer"},
                 "dist_split":
                     {"type" : "integer"},
+                "network_sampling":
+                    {"type" : "boolean"},
                 "knn":
                     {"type" : "integer"},
+                "merge_distance":
+                    {"type" : "number"},
+                "workers":
+                    {"type" : "integer"},
+                "tile_size":
+                    {"type" : "number"},
                 "distance":
                     {"type" : "integer"},
                 "weight":
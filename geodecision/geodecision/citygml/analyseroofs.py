@@ -6,20 +6,19 @@ city_gml_treatment.py
 """
 
 from xml.etree import ElementTree as ET
-from pyproj import Transformer
+from pyproj import Transformer, CRS
 import numpy as np
-import math
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Polygon
+import shapely
 import sys
-from geopy.distance import geodesic as distance
 import json
 import os
 
 from ..logger.logger import logger
 from .categories import get_dict_color, make_cat
-from .constants import REF_VECTOR, NAMESPACES, Coords, L_coords, PUBLIC, AVG_HEIGHT
+from .constants import REF_VECTOR, PUBLIC, AVG_HEIGHT
+from .constants import GML_ID, TAGS, POSLISTS_BATCH
 
 
 class GetRoofsAndSlopes:
@@ -33,7 +32,8 @@ class GetRoofsAndSlopes:
             palette="viridis", 
             driver="GeoJSON",
             attributes = [],
-            mean_height = 3.0
+            mean_height = 3.0,
+            aoi = None
             ):
         """
         Description
@@ -80,17 +80,64 @@ class GetRoofsAndSlopes:
             - mean height in case of no information on building levels. Used 
             to measure a mean of levels
             - default: 3
+        - aoi(tuple or Shapely geometry):
+            - area of interest in epsg_out: bbox (minx, miny, maxx, maxy) or 
+            (Multi-)Polygon. Buildings outside (tested on their envelope or 
+            on their first ground posList) are skipped while parsing
+            - default: None (all buildings)
         """        
-        tree = ET.parse(gml_file)
-        self.root = tree.getroot()
-        
-        self.name = name
-        self.driver = driver
+        self.gml_file = gml_file
         self.epsg_out = epsg_out
         self.palette = palette
         self.attributes = attributes
+        self._set_output(name, out_dir, driver)
+        
+        if epsg_in != epsg_out:
+            self.transformer = Transformer.from_crs(
+                    epsg_in, 
+                    epsg_out, 
+                    always_xy=True
+                    )
+            logger.info(
+                "Value for espg_in: {}\nValue for epsg_out: {}".format(
+                epsg_in,
+                epsg_out
+                )
+            )
+        else:
+            self.transformer = None
+            logger.warning(
+                    "Value for espg_in: {}\nValue for epsg_out: {}".format(
+                    epsg_in,
+                    epsg_out
+                    )
+            )
+        logger.info("gml_file: {}".format(gml_file))
+        
+        self._set_aoi(aoi, epsg_in, epsg_out)
+        self.get_df()
+    
+    def _set_output(self, name, out_dir, driver):
+        """
+        Description
+        ------------
+        
+        Set output parameters (name, directory, driver and extension)
+        
+        Parameters
+        -----------
+        
+        - name(str):
+            - output file name ("": no file is written)
+        - out_dir(str):
+            - path to the output directory
+        - driver(str):
+            - output format ("GeoJSON", "ESRI Shapefile", "GPKG")
+        """
+        self.name = name
+        self.driver = driver
         self.out_dir = out_dir
-
+        
         if self.driver == "ESRI Shapefile":
             logger.warning(
                     """
@@ -106,29 +153,60 @@ class GetRoofsAndSlopes:
             self.name = ''.join(e for e in name if e.isalnum())
             self.extension = ".gpkg"
             
-            if epsg_out == None:
+            if self.epsg_out == None:
                 logger.warning("For shapefile output, espg_out need to be set")
                 sys.exit()
+    
+    def _set_aoi(self, aoi, epsg_in, epsg_out):
+        """
+        Description
+        ------------
+        
+        Set the area of interest (reprojected once to epsg_in to be tested 
+        against raw CityGML coordinates)
+        
+        Parameters
+        -----------
+        
+        - aoi(tuple or Shapely geometry):
+            - bbox (minx, miny, maxx, maxy) or (Multi-)Polygon in epsg_out
+        - epsg_in(int): 
+            - EPSG in
+        - epsg_out(int): 
+            - EPSG out
+        """
+        if aoi is None:
+            self.aoi = None
+            return
         
+        if not isinstance(aoi, shapely.Geometry):
+            aoi = shapely.box(*aoi)
         if epsg_in != epsg_out:
-            self.transformer = Transformer.from_proj(epsg_in, epsg_out)
-            logger.info(
-                "Value for espg_in: {}\nValue for epsg_out: {}".format(
-                epsg_in,
-                epsg_out
-                )
-            )
-        else:
-            self.transformer = None
-            logger.warning(
-                    "Value for espg_in: {}\nValue for epsg_out: {}".format(
-                    epsg_in,
-                    epsg_out
+            transformer = Transformer.from_crs(
+                    epsg_out, 
+                    epsg_in, 
+                    always_xy=True
                     )
-            )
-        logger.info("gml_file: {}".format(gml_file))
+            #Densify so that reprojected edges follow the original ones
+            minx, miny, maxx, maxy = aoi.bounds
+            aoi = shapely.segmentize(aoi, max(maxx - minx, maxy - miny) / 100)
+            aoi = shapely.transform(
+                    aoi, 
+                    lambda xy: np.column_stack(
+                            transformer.transform(xy[:, 0], xy[:, 1])
+                            )
+                    )
+        shapely.prepare(aoi)
+        self.aoi = aoi
+    
+    def _in_aoi(self, geometry):
+        """
+        Description
+        ------------
         
-        self.get_df()
+        Check if a geometry (in epsg_in) intersects the area of interest
+        """
+        return self.aoi is None or self.aoi.intersects(geometry)
     
     def _normalize(self, inputs):
         """
@@ -227,12 +305,16 @@ class GetRoofsAndSlopes:
         return df
         
     
-    def _surface_normal(self, poly):
+    def _surface_normals(self, coords, offsets):
         """
         Description
         ------------
         
-        Get the surface normal of a roof polygon
+        Get the surface normals (Newell's method) of all polygons of a 
+        ragged array of coordinates at once: each vertex is paired with the 
+        next one of its polygon (rolled neighbours) and terms are summed by 
+        polygon (reduceat). Coordinates are centered on the first vertex of 
+        their polygon for precision.
         
         Sources:
             - https://fr.wikipedia.org/wiki/Normale_%C3%A0_une_surface
@@ -242,241 +324,411 @@ class GetRoofsAndSlopes:
         Returns
         --------
         
-        Surface normal
+        Numpy array (n_polygons, 3) of (not normalized) surface normals
         
         Parameters
         -----------
         
-        - poly(Shapely polygon)
+        - coords(Numpy array (n, 3))
+        - offsets(Numpy array):
+            - offsets of each polygon in coords
         """
-        #TODO: NEED TO TEST THIS FUNCTION MORE ! STRANGE BEHAVIORS
-        n = [0.0, 0.0, 0.0]
-    
-        for i, v_curr in enumerate(poly):
-            v_next = poly[(i+1) % len(poly)]
-            n[0] += (v_curr.y - v_next.y) * (v_curr.z + v_next.z)
-            n[1] += (v_curr.z - v_next.z) * (v_curr.x + v_next.x)
-            n[2] += (v_curr.x - v_next.x) * (v_curr.y + v_next.y)
-        
-        if n == [0.0, 0.0, 0.0] or sum(n)==0:
-            normalised = None
-        else:
-            normalised = [i/sum(n) for i in n]
+        counts = np.diff(offsets)
+        nonempty = counts > 0
+        starts = offsets[:-1][nonempty] - offsets[0]
+        ends = offsets[1:][nonempty] - offsets[0] - 1
+        
+        current = coords[offsets[0]:offsets[-1]]
+        current = current - np.repeat(current[starts], counts[nonempty], axis=0)
+        next_pos = np.arange(1, len(current) + 1)
+        next_pos[ends] = starts
+        following = current[next_pos]
+        
+        terms = np.column_stack([
+                (current[:, 1] - following[:, 1]) * (current[:, 2] + following[:, 2]),
+                (current[:, 2] - following[:, 2]) * (current[:, 0] + following[:, 0]),
+                (current[:, 0] - following[:, 0]) * (current[:, 1] + following[:, 1])
+                ])
+        
+        normals = np.zeros((len(counts), 3))
+        if len(starts) > 0:
+            normals[nonempty] = np.add.reduceat(terms, starts, axis=0)
             
-        return normalised
-    
+        return normals
     
-    def _unit_vector(self, vector):
-        """ 
+    def _poslists_to_coords(self, posLists):
+        """
         Description
         ------------
         
-        Get the unit vector of a vector
-        
-        Source: https://stackoverflow.com/a/13849249
+        Parse CityGML posLists (x y z x y z ...) to a ragged array of 
+        coordinates: all coordinates in one array and offsets of each 
+        posList (coordinates of i-th posList: coords[offsets[i]:offsets[i+1]])
+        Values after the last complete (x y z) triplet are ignored.
         
         Returns
         --------
         
-        Unit vector of the vector
+        coords (Numpy array (n, 3)), offsets (Numpy array)
         
         Parameters
         -----------
         
-        - vector(Numpy vector)
+        - posLists(list): 
+            - list of CityGML posLists text
         """
+        posLists = [posList or "" for posList in posLists]
+        counts = np.fromiter(
+                (len(posList.split()) for posList in posLists), 
+                dtype=np.int64, 
+                count=len(posLists)
+                )
+        #All values parsed at once (text joined then converted by Numpy)
+        values = np.array(" ".join(posLists).split(), dtype=np.float64)
         
-        return vector / np.linalg.norm(vector)
+        #Drop incomplete triplets
+        if (counts % 3).any():
+            logger.warning(
+                    """
+                    {} posLists with incomplete coordinates
+                    """.format((counts % 3 != 0).sum())
+                    )
+            rank = np.arange(len(values)) - np.repeat(
+                    np.cumsum(counts) - counts, 
+                    counts
+                    )
+            values = values[rank < np.repeat(counts - counts % 3, counts)]
+        
+        offsets = np.zeros(len(posLists) + 1, dtype=np.int64)
+        np.cumsum(counts // 3, out=offsets[1:])
+        
+        return values.reshape(-1, 3), offsets
     
-    def _angle_between(self, v1, v2):
-        """ 
+    def _flush_posLists(self):
+        """
         Description
         ------------
         
-        Get the angle between two vectors
-        
-        Source: https://stackoverflow.com/a/13849249
+        Parse the posLists of the current batch (roofs and grounds) to 
+        numeric ragged arrays (see self._poslists_to_coords) and free their 
+        text, so that only numeric arrays are kept while parsing the file
         
         Returns
         --------
         
-        Angle in radians between vectors 'v1' and 'v2'::
+        None
+        """
+        for posLists, batches in (
+                (self.posLists, self.coords_roofs),
+                (self.posLists_ground, self.coords_grounds)
+                ):
+            if len(posLists) > 0:
+                batches.append(self._poslists_to_coords(posLists))
+                posLists.clear()
     
-                >>> angle_between((1, 0, 0), (0, 1, 0))
-                1.5707963267948966
-                >>> angle_between((1, 0, 0), (1, 0, 0))
-                0.0
-                >>> angle_between((1, 0, 0), (-1, 0, 0))
-                3.141592653589793
+    def _concat_coords(self, batches):
+        """
+        Description
+        ------------
+        
+        Concatenate batches of ragged arrays of coordinates
+        
+        Returns
+        --------
+        
+        coords (Numpy array (n, 3)), counts (Numpy array): number of 
+        coordinates of each posList
         
         Parameters
         -----------
         
-        - v1(Numpy vector)
-        - v2(Numpy vector)
+        - batches(list):
+            - list of (coords, offsets) (see self._poslists_to_coords)
         """
-        v1_u = self._unit_vector(v1)
-        v2_u = self._unit_vector(v2)
+        if len(batches) == 0:
+            return np.zeros((0, 3)), np.zeros(0, dtype=np.int64)
         
-        return math.degrees(
-                np.arccos(
-                        np.clip(
-                                np.dot(v1_u, v2_u), 
-                                -1.0, 1.0
-                                )
-                        )
-                        )
+        return (
+                np.concatenate([coords for coords, _ in batches]),
+                np.concatenate([np.diff(offsets) for _, offsets in batches])
+                )
     
-    def _poslist_to_coords(self, posList):
+    def _transform(self, coords):
         """
         Description
         ------------
         
-        Get the unit vector of a vector
-        
-        Source: https://stackoverflow.com/a/13849249
+        Reproject (x, y) of coordinates with one batched transformer call
         
         Returns
         --------
         
-        List of coordinates for Bokeh mapping and 
-        list of coordinates for futur Shapely Polygon
+        Numpy array (n, 2)
         
         Parameters
         -----------
         
-        - posList(str): 
-            - list of CityGML RoofSurface coordinates
-        - transformer(object): 
-            - pyproj object for reprojection
-        """
-        xs, ys, zs = [], [], []
-        poly = []
-        l = list(map(eval, posList.split()))
-        coords = [Coords(*l[i:i + 3]) for i in range(0, len(l), 3)]
-        
-        for coord in coords:
-            if self.transformer is not None:
-                x,y = self.transformer.transform(coord.x, coord.y)
-            else:
-                x = coord.x
-                y = coord.y
-                
-            xs.append(x)
-            ys.append(y)
-            zs.append(coord.z)
-            
-            poly.append(Coords(coord.x,coord.y,coord.z))
-            
-        return L_coords(xs, ys, zs), poly
+        - coords(Numpy array (n, 3))
+        """
+        if self.transformer is None:
+            return coords[:, :2].copy()
+        
+        x, y = self.transformer.transform(coords[:, 0], coords[:, 1])
+        
+        return np.column_stack([x, y])
+    
+    def _make_polygons(self, xy, offsets):
+        """
+        Description
+        ------------
+        
+        Returns Shapely Polygons from a ragged array of coordinates (None 
+        when the posList has less than 3 coordinates)
+        
+        Parameters
+        -----------
+        
+        - xy(Numpy array (n, 2))
+        - offsets(Numpy array):
+            - offsets of each posList in xy (a slice of offsets can be 
+            given to use a part of xy)
+        """
+        xy = xy[offsets[0]:offsets[-1]]
+        counts = np.diff(offsets)
+        polygons = np.full(len(counts), None, dtype=object)
+        valid = np.flatnonzero(counts >= 3)
+        rings = shapely.linearrings(
+                xy[np.repeat(counts >= 3, counts)],
+                indices=np.repeat(np.arange(len(valid)), counts[valid])
+                )
+        polygons[valid] = shapely.polygons(rings)
+        
+        return polygons
     
-    def _add_poly(self, x):
+    def _split(self, values, offsets):
         """
         Description
         ------------
         
-        Returns Shapely Polygon when length of coordinates list >= 3
+        Split a ragged array (or a part of it, see self._make_polygons) to a 
+        list of lists (one for each posList)
         """
-        if len(x["xs"]) >= 3:
-            poly =  Polygon([(x,y) for x,y in zip(x["xs"], x["ys"])])
-        else:
-            poly = None
-            
-        return poly
+        return [
+                part.tolist() for part in np.split(
+                        values[offsets[0]:offsets[-1]], 
+                        offsets[1:-1] - offsets[0]
+                        )
+                ]
     
-    def _get_min_width(self, poly):
+    def _get_min_widths(self, geometries):
         """
         Description
         ------------
         
-        Get the minimum width of a polygon
+        Get the minimum widths of polygons: shortest side of their minimum 
+        rotated rectangles (computed at once)
         
         See: https://shapely.readthedocs.io/en/stable/manual.html#object.minimum_rotated_rectangle
         
         Returns
         --------
         
-        Minimum width
+        Numpy array of minimum widths (NaN if the minimum rotated rectangle 
+        is not a Polygon)
         
         Parameters
         -----------
         
-        - poly(Shapely polygon):
-            - projection MUST BE EPSG 4326 to avoid 
-            ValueError: Latitude must be in the [-90; 90] range.
+        - geometries(array of Shapely polygons):
+            - projection MUST BE metric
         """
+        rectangles = shapely.minimum_rotated_rectangle(geometries)
+        polygons = shapely.get_type_id(rectangles) == 3
+        
+        rings = shapely.get_exterior_ring(rectangles[polygons])
+        corners = [shapely.get_point(rings, i) for i in range(3)]
+        min_widths = np.full(len(geometries), np.nan)
+        min_widths[polygons] = np.minimum(
+                shapely.distance(corners[0], corners[1]),
+                shapely.distance(corners[1], corners[2])
+                )
         
-        distances = []
-        min_rot_rect = poly.minimum_rotated_rectangle
-        
-        if isinstance(min_rot_rect, Polygon):
-            coords = min_rot_rect.exterior.coords
-            for i,coord in enumerate(coords[0:2]):
-                distances.append(distance(coord, coords[i+1]).meters)
-            
-            return min(distances)
-        else:
+        for geometry in np.asarray(geometries)[~polygons]:
             logger.info(
                     """
                     {} is not a Polygon
-                    """.format(poly.wkt)
+                    """.format(geometry.wkt)
                     )
-            return gpd.np.nan
         
+        return min_widths
+    
+    def _iter_buildings(self):
+        """
+        Description
+        ------------
+        
+        Stream the Buildings of the CityGML file in a single traversal 
+        (iterparse), one Building at a time. Processed elements are cleared 
+        so that memory does not grow with the file size.
+        With an area of interest, a Building is tested as soon as its 
+        envelope (or, without envelope, its first ground posList) is read: 
+        posLists of Buildings outside are not kept and they are not yielded.
+        
+        Returns
+        --------
+        
+        Generator of buildings records (dict):
+            - id: id of GML building
+            - attributes: dict of named attributes
+            - height: measured height (None if missing)
+            - roofs, grounds: lists of (surface id, element, posList text)
+        
+        """
+        events = ET.iterparse(self.gml_file, events=("start", "end"))
+        _, root = next(events)
+        #Depth of nested Buildings, current record and surface
+        depth = 0
+        record = None
+        surface = None
+        
+        for event, elem in events:
+            tag = elem.tag
+            if event == "start":
+                if tag == TAGS["building"]:
+                    depth += 1
+                    if depth == 1:
+                        record = {
+                            "id":elem.attrib.get(GML_ID),
+                            "attributes":{},
+                            "height":None,
+                            "roofs":[],
+                            "grounds":[]
+                            }
+                        #None: not tested yet
+                        inside = True if self.aoi is None else None
+                        corners = {}
+                elif depth > 0 and tag in (TAGS["roof"], TAGS["ground"]):
+                    surface = (
+                        record["roofs" if tag == TAGS["roof"] else "grounds"],
+                        elem.attrib.get(GML_ID),
+                        tag == TAGS["ground"]
+                        )
+                    element = 0
+                continue
+            
+            if depth == 0:
+                continue
+            elif tag == TAGS["poslist"] and surface is not None:
+                if inside is None and surface[2] is True:
+                    values = np.array(elem.text.split(), dtype=np.float64)
+                    xy = values[:len(values) // 3 * 3].reshape(-1, 3)[:, :2]
+                    if len(xy) >= 3:
+                        inside = self._in_aoi(shapely.polygons(xy))
+                    elif len(xy) > 0:
+                        inside = self._in_aoi(shapely.multipoints(xy))
+                if inside is not False:
+                    surface[0].append((surface[1], element, elem.text))
+                element += 1
+            elif tag in (TAGS["lower"], TAGS["upper"]) and surface is None:
+                corners[tag] = [float(v) for v in elem.text.split()[:2]]
+            elif tag == TAGS["envelope"] and surface is None:
+                if inside is None and len(corners) == 2:
+                    inside = self._in_aoi(
+                        shapely.box(*corners[TAGS["lower"]], *corners[TAGS["upper"]])
+                        )
+            elif tag in (TAGS["roof"], TAGS["ground"]):
+                surface = None
+            elif tag == TAGS["height"]:
+                record["height"] = float(elem.text)
+            elif tag == TAGS["building"]:
+                depth -= 1
+                if depth == 0:
+                    for x in elem:
+                        s = x.attrib.get("name")
+                        if s is not None:
+                            record["attributes"][s] = x[0].text
+                    #Buildings without envelope and ground are kept
+                    if inside is not False:
+                        yield record
+                    #Free the processed Building (and its ancestors' links)
+                    elem.clear()
+                    root.clear()
     
-    def _get_roofs(self, building, id_building):
+    def _get_roofs(self, roofs, id_building):
         """
         Description
         ------------
         
-        Get roofs, roofs area and angles (from self._angle_between)
+        Get roofs (angles are computed for all roofs by self._get_angles)
         
         Returns
         --------
         
-        Areas and angles
+        
         
         Parameters
         -----------
         
-        - building(building GML):
-            - City GML object
+        - roofs(list):
+            - list of (RoofSurface id, element, posList text)
         - id_building(string): 
             - id of GML building
         """
-        for RoofSurface in building.findall('.//ns2:RoofSurface', NAMESPACES):
-            i=0
-            for posList in RoofSurface.findall('.//ns1:posList', NAMESPACES):
-                id_ = RoofSurface.attrib["{http://www.opengis.net/gml}id"]
-                self.building_ids.append(id_building)
-                coords, poly = self._poslist_to_coords(
-                        posList.text
+        for id_, i, posList in roofs:
+            self.building_ids.append(id_building)
+            self.posLists.append(posList)
+            self.ids.append(id_)
+            self.elements.append(i)
+    
+    def _get_angles(self, coords, offsets):
+        """
+        Description
+        ------------
+        
+        Get roofs angles (slopes in degrees) from their surface normals.
+        Angles are between 0 and 90 degrees whatever the orientation of the 
+        posList: a clockwise posList (normal pointing down) used to give 
+        180 - slope, it now gives the slope. Degenerate roofs (null normal) 
+        get 90.
+        
+        Parameters
+        -----------
+        
+        - coords(Numpy array (n, 3)):
+            - roofs coordinates (ragged array)
+        - offsets(Numpy array):
+            - offsets of each roof posList in coords
+        """
+        normals = self._surface_normals(coords, offsets)
+        norms = np.linalg.norm(normals, axis=1)
+        valid = norms > 0
+        
+        #Slope: angle between the normal and the vertical (whatever the 
+        # orientation of the polygon)
+        self.angles = np.full(len(norms), 90.0)
+        self.angles[valid] = np.degrees(
+                np.arccos(
+                        np.clip(
+                                np.abs(normals[valid] @ REF_VECTOR) / norms[valid],
+                                0.0, 1.0
+                                )
                         )
-                self.xs.append(coords.xs)
-                self.ys.append(coords.ys)
-                self.zs.append(coords.zs)
-                self.ids.append(id_)
-                self.elements.append(i)
-                vector = self._surface_normal(poly)
-                if vector == None:
-                    logger.warning(
-                            """
-                            RoofSurface with id {} has problematic posList at position {}: 
-                            {}
-                            Angle of this will be 90 (in degrees) to highlight the problem
-                            """.format(
-                                id_, 
-                                i, 
-                                posList.text,
-                            )
+                )
+        
+        for i in np.flatnonzero(~valid):
+            logger.warning(
+                    """
+                    RoofSurface with id {} has problematic posList at position {}: 
+                    {}
+                    Angle of this will be 90 (in degrees) to highlight the problem
+                    """.format(
+                        self.ids[i], 
+                        self.elements[i], 
+                        coords[offsets[i]:offsets[i + 1]].ravel(),
                     )
-                    self.angles.append(90.0)
-                else:
-                    self.angles.append(self._angle_between(vector, REF_VECTOR))
-                
-                i+=1
+            )
     
-    def _get_grounds(self, building, id_building):
+    def _get_grounds(self, grounds, id_building):
         """
         Description
         ------------
@@ -491,27 +743,18 @@ class GetRoofsAndSlopes:
         Parameters
         -----------
         
-        - building(building GML):
-            - City GML object
+        - grounds(list):
+            - list of (GroundSurface id, element, posList text)
         - id_building(string): 
             - id of GML building
         """
-        for GroundSurface in building.findall('.//ns2:GroundSurface', NAMESPACES):
-            i=0
-            for posList in GroundSurface.findall('.//ns1:posList', NAMESPACES):
-                id_ = GroundSurface.attrib["{http://www.opengis.net/gml}id"]
-                self.building_ids_ground.append(id_building)
-                coords, poly = self._poslist_to_coords(
-                        posList.text
-                        )
-                self.xs_ground.append(coords.xs)
-                self.ys_ground.append(coords.ys)
-                self.zs_ground.append(coords.zs)
-                self.ids_ground.append(id_)
-                self.elements_ground.append(i)
-                i+=1
+        for id_, i, posList in grounds:
+            self.building_ids_ground.append(id_building)
+            self.posLists_ground.append(posList)
+            self.ids_ground.append(id_)
+            self.elements_ground.append(i)
     
-    def _get_height_levels(self, building, id_building):
+    def _get_height_levels(self, height, id_building):
         """
         Description
         ------------
@@ -522,13 +765,13 @@ class GetRoofsAndSlopes:
         Parameters
         -----------
         
-        - building(building GML):
-            - City GML object
+        - height(float): 
+            - measured height of GML building (None if missing)
         - id_building(string): 
             - id of GML building
         """
-        for measuredHeight in building.findall('.//ns2:measuredHeight', NAMESPACES):
-            height = float(measuredHeight.text)
+        if height is None:
+            height = np.nan
         
         self.heights[id_building] = height
         self.levels[id_building] = height//AVG_HEIGHT
@@ -598,19 +841,17 @@ class GetRoofsAndSlopes:
         DataFrame and GeoDataframe
         
         """
-        #Lists for roofs
-        self.xs = []
-        self.ys = []
-        self.zs = []
-        self.angles = []
+        #Lists for roofs (posLists text of the current batch, parsed 
+        # batches of coordinates)
+        self.posLists = []
+        self.coords_roofs = []
         self.ids = []
         self.elements = []
         self.building_ids = []
         
         #Lists for grounds
-        self.xs_ground = []
-        self.ys_ground = []
-        self.zs_ground = []
+        self.posLists_ground = []
+        self.coords_grounds = []
         self.ids_ground = []
         self.elements_ground = []
         self.building_ids_ground = []
@@ -620,28 +861,45 @@ class GetRoofsAndSlopes:
         self.levels = {}
         
         dict_buildings = {}
-        for building in self.root.findall('.//ns2:Building', NAMESPACES):
-            dict_tmp = {}
-            id_building = building.attrib.get("{http://www.opengis.net/gml}id")
-            for x in building:
-                s = x.attrib.get("name")
-                if s is not None:
-                    dict_tmp[s] = x[0].text
-            dict_buildings[id_building] = dict_tmp
-        
-            self._get_roofs(building, id_building)
-            self._get_grounds(building, id_building)
-            self._get_height_levels(building, id_building)
-            
+        for building in self._iter_buildings():
+            id_building = building["id"]
+            dict_buildings[id_building] = building["attributes"]
+        
+            self._get_roofs(building["roofs"], id_building)
+            self._get_grounds(building["grounds"], id_building)
+            self._get_height_levels(building["height"], id_building)
+            if len(self.posLists) + len(self.posLists_ground) >= POSLISTS_BATCH:
+                self._flush_posLists()
+        self._flush_posLists()
+        
+        #All coordinates (roofs then grounds) in a ragged array, reprojected 
+        # at once
+        coords_roofs, counts_roofs = self._concat_coords(self.coords_roofs)
+        coords_grounds, counts_grounds = self._concat_coords(
+                self.coords_grounds
+                )
+        del self.coords_roofs, self.coords_grounds
+        coords = np.concatenate([coords_roofs, coords_grounds])
+        n_roofs = len(counts_roofs)
+        offsets = np.zeros(n_roofs + len(counts_grounds) + 1, dtype=np.int64)
+        np.cumsum(
+                np.concatenate([counts_roofs, counts_grounds]), 
+                out=offsets[1:]
+                )
+        xy = self._transform(coords)
+        roofs_offsets = offsets[:n_roofs + 1]
+        grounds_offsets = offsets[n_roofs:]
+        
+        self._get_angles(coords, roofs_offsets)
             
         df_roofs = pd.DataFrame.from_dict(
             {
                 "ids":self.ids,
                 "building_ids":self.building_ids,
                 "elements":self.elements,
-                "xs":self.xs,
-                "ys":self.ys,
-                "zs":self.zs,
+                "xs":self._split(xy[:, 0], roofs_offsets),
+                "ys":self._split(xy[:, 1], roofs_offsets),
+                "zs":self._split(coords[:, 2], roofs_offsets),
                 "angles":self.angles,
             }
         )
@@ -650,9 +908,9 @@ class GetRoofsAndSlopes:
             {
                 "building_ids":self.building_ids_ground,
                 "ids":self.ids_ground,
-                "xs":self.xs_ground,
-                "ys":self.ys_ground,
-                "zs":self.zs_ground,
+                "xs":self._split(xy[:, 0], grounds_offsets),
+                "ys":self._split(xy[:, 1], grounds_offsets),
+                "zs":self._split(coords[:, 2], grounds_offsets),
                 "elements":self.elements_ground
             }
         )
@@ -675,7 +933,9 @@ class GetRoofsAndSlopes:
         df_roofs["nb_levels"] = df_roofs["building_ids"].map(self.levels)
         
         #Create GeoDataframe to make some measures
-        df_roofs["geometry"] = df_roofs.apply(self._add_poly, axis=1)
+        df_roofs["geometry"] = pd.Series(
+                self._make_polygons(xy, roofs_offsets)
+                )
         #Combine with all df_buildings attributes
         df_roofs = df_roofs.merge(
                 df_buildings, 
@@ -683,8 +943,11 @@ class GetRoofsAndSlopes:
                 left_on="building_ids", 
                 how="right"
                 )
-        gdf_roofs = gpd.GeoDataFrame(df_roofs, geometry="geometry")
-        gdf_roofs.crs = {"init":"epsg:{}".format(self.epsg_out)}
+        gdf_roofs = gpd.GeoDataFrame(
+                df_roofs, 
+                geometry="geometry", 
+                crs=self.epsg_out
+                )
         
         #Drop duplicates and NaN geometries
         gdf_roofs = gdf_roofs.drop_duplicates(
@@ -703,21 +966,33 @@ class GetRoofsAndSlopes:
         ##see: https://fisherzachary.github.io/public/r-output.html
         gdf_roofs["convex_hull_area"] = gdf_roofs.convex_hull.area
         gdf_roofs["compactness"] = gdf_roofs["area"] / gdf_roofs["convex_hull_area"]
-        #Project to EPSG 4326 and drop missing geometries
+        #Drop missing geometries
         gdf_roofs = gdf_roofs.dropna(subset=["geometry"])
-        #Change projection to fit with self._get_min_width requirements
-        gdf_roofs = gdf_roofs.to_crs(epsg=4326)
-        gdf_roofs["min_width"] = gdf_roofs["geometry"].map(self._get_min_width)
-        #Back to previous EPSG
-        gdf_roofs = gdf_roofs.to_crs(epsg=self.epsg_out)
+        #Minimum width in a metric CRS (UTM zone if epsg_out is geographic)
+        geometries = gdf_roofs.geometry
+        if CRS.from_epsg(self.epsg_out).is_geographic:
+            logger.warning(
+                    """
+                    EPSG {} is geographic, min_width is measured in UTM
+                    """.format(self.epsg_out)
+                    )
+            geometries = geometries.to_crs(gdf_roofs.estimate_utm_crs())
+        gdf_roofs["min_width"] = self._get_min_widths(
+                np.asarray(geometries.values)
+                )
 #        #Replace space strings
 #        df_buildings.replace(" ", gpd.np.nan, inplace=True) 
 #        #Drop nan
 #        df_buildings.dropna(how="all", inplace=True)
 #        
-        df_grounds["geometry"] = df_grounds.apply(self._add_poly, axis=1)
-        gdf_grounds = gpd.GeoDataFrame(df_grounds, geometry="geometry")
-        gdf_grounds.crs = {"init":"epsg:{}".format(self.epsg_out)}
+        df_grounds["geometry"] = pd.Series(
+                self._make_polygons(xy, grounds_offsets)
+                )
+        gdf_grounds = gpd.GeoDataFrame(
+                df_grounds, 
+                geometry="geometry", 
+                crs=self.epsg_out
+                )
         gdf_grounds.drop(
                 columns=["xs","ys","zs"], 
                 inplace=True
@@ -748,57 +1023,77 @@ class GetRoofsAndSlopes:
 #                "public_access"
 #                )
         
-        if self.name != "":
-            if (self.driver == "GeoJSON") or (self.driver == "ESRI Shapefile"): 
-                #Check if file exists, delete it if so before writting it 
-                ##(necessary because of Fiona behavior with GeoJSON)
-                name_to_check = self.name + "_roofs" + self.extension
-                name_to_check = os.path.join(self.out_dir, self.name)
-                try:
-                    os.remove(name_to_check)
-                except OSError:
-                    pass
-                name = self.name + "_roofs" + self.extension
-                name = os.path.join(self.out_dir, name)
-                gdf_roofs.to_file(
-                        name,
-                        driver=self.driver,
-                        encoding="utf-8"
-                        )
-                name = self.name + "_grounds" + self.extension
-                name = os.path.join(self.out_dir, name)
-                gdf_grounds.to_file(
-                        name, 
-                        driver=self.driver,
-                        encoding="utf-8"
-                        )
-                
-            elif self.driver == "GPKG":
-                name = "Roofs" + self.extension
-                gdf_roofs.to_file(
-                        os.path.join(self.out_dir, name), 
-                        layer=self.name, 
-                        driver=self.driver,
-                        encoding="utf-8"
-                        )
-                name = "Grounds" + self.extension
-                gdf_grounds.to_file(
-                        os.path.join(self.out_dir, name),
-                        layer=self.name,  
-                        driver=self.driver,
-                        encoding="utf-8"
-                        )
-            else:
-                print ("""
-                       Wrong name for the output format
-                       Choice between "GeoJSON", "ESRI Shapefile" and "GPKG"
-                       """)
-            buildings_name = os.path.splitext(self.name)[0] + ".json" 
-            buildings_name = os.path.join(self.out_dir, buildings_name)
-            data = df_buildings.to_json(orient="index")
-            with open(buildings_name, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-        
         self.df_buildings = df_buildings
         self.df_roofs = df_roofs
-        self.gdf_roofs = gdf_roofs 
\ No newline at end of file
+        self.gdf_roofs = gdf_roofs
+        self.gdf_grounds = gdf_grounds
+        
+        if self.name != "":
+            self.write()
+    
+    def write(self):
+        """
+        Description
+        ------------
+        
+        Write roofs and grounds (self.driver format) and buildings (JSON)
+        
+        Returns
+        --------
+        
+        None
+        
+        """
+        gdf_roofs = self.gdf_roofs
+        gdf_grounds = self.gdf_grounds
+        df_buildings = self.df_buildings
+        
+        if (self.driver == "GeoJSON") or (self.driver == "ESRI Shapefile"): 
+            #Check if file exists, delete it if so before writting it 
+            ##(necessary because of Fiona behavior with GeoJSON)
+            name_to_check = self.name + "_roofs" + self.extension
+            name_to_check = os.path.join(self.out_dir, self.name)
+            try:
+                os.remove(name_to_check)
+            except OSError:
+                pass
+            name = self.name + "_roofs" + self.extension
+            name = os.path.join(self.out_dir, name)
+            gdf_roofs.to_file(
+                    name,
+                    driver=self.driver,
+                    encoding="utf-8"
+                    )
+            name = self.name + "_grounds" + self.extension
+            name = os.path.join(self.out_dir, name)
+            gdf_grounds.to_file(
+                    name, 
+                    driver=self.driver,
+                    encoding="utf-8"
+                    )
+                
+        elif self.driver == "GPKG":
+            name = "Roofs" + self.extension
+            gdf_roofs.to_file(
+                    os.path.join(self.out_dir, name), 
+                    layer=self.name, 
+                    driver=self.driver,
+                    encoding="utf-8"
+                    )
+            name = "Grounds" + self.extension
+            gdf_grounds.to_file(
+                    os.path.join(self.out_dir, name),
+                    layer=self.name,  
+                    driver=self.driver,
+                    encoding="utf-8"
+                    )
+        else:
+            print ("""
+                   Wrong name for the output format
+                   Choice between "GeoJSON", "ESRI Shapefile" and "GPKG"
+                   """)
+        buildings_name = os.path.splitext(self.name)[0] + ".json" 
+        buildings_name = os.path.join(self.out_dir, buildings_name)
+        data = df_buildings.to_json(orient="index")
+        with open(buildings_name, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
@@ -16,6 +16,22 @@ NAMESPACES = {
     'ns2': "http://www.opengis.net/citygml/building/2.0"
 }
 
+#Tags and attributes (ElementTree format) for streaming parsing
+GML_ID = "{{{}}}id".format(NAMESPACES["ns1"])
+TAGS = {
+    "building":"{{{}}}Building".format(NAMESPACES["ns2"]),
+    "roof":"{{{}}}RoofSurface".format(NAMESPACES["ns2"]),
+    "ground":"{{{}}}GroundSurface".format(NAMESPACES["ns2"]),
+    "height":"{{{}}}measuredHeight".format(NAMESPACES["ns2"]),
+    "poslist":"{{{}}}posList".format(NAMESPACES["ns1"]),
+    "envelope":"{{{}}}Envelope".format(NAMESPACES["ns1"]),
+    "lower":"{{{}}}lowerCorner".format(NAMESPACES["ns1"]),
+    "upper":"{{{}}}upperCorner".format(NAMESPACES["ns1"])
+}
+
+#Number of posLists kept as text before they are parsed to numeric arrays
+POSLISTS_BATCH = 10000
+
 Coords = namedtuple("Coords", ["x","y","z"])
 L_coords = namedtuple("L_coords", ["xs","ys", "zs"])
 
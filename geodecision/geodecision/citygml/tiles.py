@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tiles.py
+@author: Thomas Leysens
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from ..logger.logger import logger
+from .analyseroofs import GetRoofsAndSlopes
+
+
+def _get_tile(args):
+    """
+    Description
+    ------------
+
+    Worker function: get buildings, roofs and grounds of one CityGML tile
+    (no file is written)
+
+    Returns
+    --------
+
+    (df_buildings, gdf_roofs, gdf_grounds)
+
+    Parameters
+    -----------
+
+    - args(tuple):
+        - (gml_file, epsg_in, epsg_out, keyword arguments of
+        GetRoofsAndSlopes)
+    """
+    gml_file, epsg_in, epsg_out, kwargs = args
+    tile = GetRoofsAndSlopes(gml_file, epsg_in, epsg_out, name="", **kwargs)
+
+    return tile.df_buildings, tile.gdf_roofs, tile.gdf_grounds
+
+
+class GetRoofsAndSlopesTiles(GetRoofsAndSlopes):
+    def __init__(
+            self,
+            gml_files,
+            epsg_in,
+            epsg_out,
+            name="",
+            out_dir="",
+            palette="viridis",
+            driver="GeoJSON",
+            attributes=[],
+            mean_height=3.0,
+            aoi=None,
+            workers=1
+            ):
+        """
+        Description
+        ------------
+
+        Get roofs from several CityGML files (tiles) with GetRoofsAndSlopes,
+        in parallel processes if workers > 1.
+        Buildings, roofs and grounds of all tiles are merged (with a
+        "tile_id" column, position of the tile in gml_files, and a "tile"
+        column, its file name): a building found with the same geometry in
+        several tiles (tiles borders) is only kept from the first tile (in
+        gml_files order) and roofs and grounds get a global unique id
+        ("uid").
+        Write a single dataset if name is not "".
+
+        Returns
+        --------
+
+        DataFrame, GeoDataframes
+
+        Parameters
+        -----------
+
+        - gml_files(list or str):
+            - list of paths to CityGML files or glob pattern
+        - epsg_in(int):
+            - EPSG in
+        - epsg_out(int):
+            - EPSG out
+        - name(str):
+            - output file name
+            - default: "" (no file is written)
+        - out_dir(str):
+            - path to the output directory
+            - default: ""
+        - palette(str):
+            - name of colors palette,
+            - default: "viridis",
+            - choices: viridis, magma, plasma
+        - driver(str):
+            - output format
+            - default: "GeoJSON"
+            - choices: "GeoJSON", "ESRI Shapefile", "GPKG"
+        - attributes(list):
+            - list of attributes to qualify the buildings
+        - mean_height(float):
+            - mean height in case of no information on building levels. Used
+            to measure a mean of levels
+            - default: 3
+        - aoi(tuple or Shapely geometry):
+            - area of interest in epsg_out: bbox (minx, miny, maxx, maxy) or
+            (Multi-)Polygon (see GetRoofsAndSlopes)
+            - default: None (all buildings)
+        - workers(int):
+            - number of processes (one tile per process at a time)
+            - default: 1
+        """
+        if isinstance(gml_files, str):
+            gml_files = sorted(glob.glob(gml_files))
+        self.gml_files = list(gml_files)
+        self.epsg_out = epsg_out
+        self.workers = workers
+        self._set_output(name, out_dir, driver)
+
+        kwargs = {
+            "palette": palette,
+            "driver": driver,
+            "attributes": attributes,
+            "mean_height": mean_height,
+            "aoi": aoi
+            }
+        tasks = [
+            (gml_file, epsg_in, epsg_out, kwargs)
+            for gml_file in self.gml_files
+            ]
+
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(_get_tile, tasks))
+        else:
+            results = [_get_tile(task) for task in tasks]
+
+        self.merge(results)
+
+        if self.name != "":
+            self.write()
+
+    def _surfaces_extents(self, keys, gdf_roofs, gdf_grounds):
+        """
+        Description
+        ------------
+
+        Get the extent (bounds of all its roofs and grounds) of each
+        building of each tile
+
+        Returns
+        --------
+
+        Numpy array (len(keys), 4), NaN for buildings without surfaces
+
+        Parameters
+        -----------
+
+        - keys(DataFrame):
+            - "building_ids" and "tile_id" of buildings
+        - gdf_roofs, gdf_grounds(GeoDataFrame):
+            - merged roofs and grounds (with "tile_id")
+        """
+        surfaces = []
+        for gdf in (gdf_roofs, gdf_grounds):
+            bounds = pd.DataFrame(
+                shapely.bounds(np.asarray(gdf.geometry.values)),
+                columns=["minx", "miny", "maxx", "maxy"]
+                )
+            surfaces.append(
+                pd.concat(
+                    [gdf[["building_ids", "tile_id"]].reset_index(drop=True), bounds],
+                    axis=1
+                    )
+                )
+        surfaces = pd.concat(surfaces)
+        extents = surfaces.groupby(["building_ids", "tile_id"]).agg(
+            {"minx": "min", "miny": "min", "maxx": "max", "maxy": "max"}
+            )
+
+        return extents.reindex(
+            pd.MultiIndex.from_frame(keys[["building_ids", "tile_id"]])
+            ).values
+
+    def merge(self, results):
+        """
+        Description
+        ------------
+
+        Merge buildings, roofs and grounds of all tiles (tiles are keyed by
+        their position in self.gml_files, file names can be the same in
+        different directories). A building id found in several tiles is:
+            - dropped from the later tiles if its extent (see
+            self._surfaces_extents) is the same as in its first tile
+            (building on tiles borders)
+            - kept otherwise (id reused for another building) as
+            "<id>_<tile_id>" in the later tiles
+
+        Parameters
+        -----------
+
+        - results(list):
+            - (df_buildings, gdf_roofs, gdf_grounds) of each tile (in
+            self.gml_files order)
+        """
+        buildings, roofs, grounds = [], [], []
+        for tile_id, (gml_file, (df_buildings, gdf_roofs, gdf_grounds)) in enumerate(
+                zip(self.gml_files, results)
+                ):
+            tile = os.path.splitext(os.path.basename(gml_file))[0]
+            buildings.append(df_buildings.assign(tile_id=tile_id, tile=tile))
+            roofs.append(gdf_roofs.assign(tile_id=tile_id, tile=tile))
+            grounds.append(gdf_grounds.assign(tile_id=tile_id, tile=tile))
+
+        df_buildings = pd.concat(buildings)
+        gdf_roofs = gpd.GeoDataFrame(pd.concat(roofs, ignore_index=True))
+        gdf_grounds = gpd.GeoDataFrame(pd.concat(grounds, ignore_index=True))
+
+        # Buildings of each tile (from all tables), first tile first
+        keys = pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "building_ids": df_buildings.index,
+                        "tile_id": df_buildings["tile_id"].values
+                        }
+                    ),
+                gdf_roofs[["building_ids", "tile_id"]],
+                gdf_grounds[["building_ids", "tile_id"]]
+                ]
+            ).drop_duplicates().sort_values("tile_id", kind="stable")
+        keys = keys.reset_index(drop=True)
+
+        # Compare each copy with the first one of its building
+        extents = self._surfaces_extents(keys, gdf_roofs, gdf_grounds)
+        first = keys.groupby("building_ids", sort=False).cumcount().values == 0
+        first_pos = pd.Series(
+            np.flatnonzero(first),
+            index=keys["building_ids"].values[first]
+            )
+        same = np.isclose(
+            extents,
+            extents[first_pos.loc[keys["building_ids"]].values],
+            rtol=0.0,
+            atol=1e-6,
+            equal_nan=True
+            ).all(axis=1)
+        duplicated = ~first & same
+        reused = ~first & ~same
+
+        # New building id of each (building, tile), None if dropped
+        keys["new_ids"] = keys["building_ids"].astype(object)
+        keys.loc[reused, "new_ids"] = keys.loc[reused, "building_ids"].astype(
+            str
+            ).str.cat(keys.loc[reused, "tile_id"].astype(str), sep="_")
+        keys.loc[duplicated, "new_ids"] = None
+        new_ids = keys.set_index(["building_ids", "tile_id"])["new_ids"]
+
+        df_buildings.index = new_ids.reindex(
+            pd.MultiIndex.from_arrays([df_buildings.index, df_buildings["tile_id"]])
+            ).values
+        df_buildings = df_buildings.loc[df_buildings.index.notna()]
+        tables = []
+        for gdf in (gdf_roofs, gdf_grounds):
+            gdf["building_ids"] = new_ids.reindex(
+                pd.MultiIndex.from_arrays([gdf["building_ids"], gdf["tile_id"]])
+                ).values
+            tables.append(gdf.loc[gdf["building_ids"].notna()].copy())
+        gdf_roofs, gdf_grounds = tables
+
+        logger.info(
+            """
+            Tiles: {}
+            Duplicated buildings (tiles borders, dropped): {}
+            """.format(
+                len(self.gml_files),
+                int(duplicated.sum())
+                )
+            )
+        if reused.any():
+            logger.warning(
+                """
+                Buildings ids reused in several tiles with another geometry
+                (kept as <id>_<tile_id>): {}
+                """.format(
+                    int(reused.sum())
+                    )
+                )
+
+        gdf_roofs = gdf_roofs.sort_values(by=["angles"], ascending=False)
+        gdf_roofs.insert(0, "uid", np.arange(len(gdf_roofs)))
+        gdf_grounds.insert(0, "uid", np.arange(len(gdf_grounds)))
+
+        self.df_buildings = df_buildings
+        self.gdf_roofs = gdf_roofs.reset_index(drop=True)
+        self.gdf_grounds = gdf_grounds.reset_index(drop=True)
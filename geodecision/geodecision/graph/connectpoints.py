@@ -33,16 +33,135 @@ License of the source:
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-import rtree
-import itertools
-from shapely.geometry import MultiPoint, LineString
-from shapely.ops import snap, split
+import shapely
+from shapely import STRtree
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import pickle
 import os
 
 from ..logger.logger import logger
+from .nodeindex import NodeIndex
 
 pd.options.mode.chained_assignment = None
 
+Delta = namedtuple(
+        "Delta", 
+        ["added_nodes", "removed_nodes", "added_edges", "removed_edges"]
+        )
+
+def _query_nearest(tree, points):
+    """
+    Description
+    ------------
+    
+    Nearest geometry of each point in a STRtree (single bulk query)
+    
+    Returns
+    --------
+    
+    - positions (Numpy array): positions in the tree of nearest geometries
+    - distances (Numpy array): distances to nearest geometries
+    
+    Parameters
+    -----------
+    
+    - tree (Shapely STRtree)
+    - points (array of Shapely Points)
+    """
+    points = np.asarray(points)
+    (points_pos, tree_pos), dists = tree.query_nearest(
+            points, 
+            return_distance=True, 
+            all_matches=False
+            )
+    positions = np.empty(len(points), dtype=np.int64)
+    positions[points_pos] = tree_pos
+    distances = np.empty(len(points), dtype=np.float64)
+    distances[points_pos] = dists
+    
+    return positions, distances
+
+def _find_kne_tile(points, edges, labels):
+    """
+    Description
+    ------------
+    
+    Find the nearest edge of the points of one tile among the edges of this
+    tile (worker of ConnectPoints partitioned mode)
+    
+    Returns
+    --------
+    
+    - kne_idx (Numpy array): index labels of nearest edges
+    - kne_dist (Numpy array): distances to nearest edges (inf if no edge)
+    
+    Parameters
+    -----------
+    
+    - points (array of Shapely Points)
+    - edges (array of Shapely LineStrings)
+    - labels (Numpy array): index labels of edges
+    """
+    if len(edges) == 0:
+        return (
+                np.zeros(len(points), dtype=labels.dtype),
+                np.full(len(points), np.inf)
+                )
+    positions, distances = _query_nearest(STRtree(edges), points)
+    
+    return labels[positions], distances
+
+def apply_delta(nodes, edges, delta):
+    """
+    Description
+    ------------
+    
+    Apply a Delta (from ConnectPoints.connect) to nodes and edges 
+    GeoDataFrames of a graph
+    
+    Returns
+    --------
+    
+    Updated nodes and edges GeoDataFrames
+    
+    Parameters
+    -----------
+    
+    - nodes (GeoDataFrame):
+        - GDF of graph nodes (with 'osmid' column)
+    - edges (GeoDataFrame):
+        - GDF of graph edges (index labels are the ones of ConnectPoints)
+    - delta (Delta namedtuple):
+        - added_nodes, removed_nodes (list of osmid), added_edges, 
+        removed_edges (index labels)
+    """
+    nodes = gpd.GeoDataFrame(
+            pd.concat(
+                    [
+                            nodes.loc[
+                                    ~nodes['osmid'].isin(delta.removed_nodes)
+                                    ], 
+                            delta.added_nodes
+                            ],
+                    ignore_index=True,
+                    sort=False
+                    ),
+            crs=nodes.crs
+            )
+    edges = gpd.GeoDataFrame(
+            pd.concat(
+                    [
+                            edges.loc[~edges.index.isin(delta.removed_edges)], 
+                            delta.added_edges
+                            ],
+                    sort=False
+                    ),
+            crs=edges.crs
+            )
+    
+    return nodes, edges
+
 class ConnectPoints:
     """
     Description
@@ -61,6 +180,11 @@ class ConnectPoints:
     - edges (GeoDataFrame): the original gdf with connection edges appended
                           and existing edges updated (if PPs are present)
     
+    Once processed, new points can be connected incrementally to the 
+    updated graph with connect() (only the edges they hit are split). The 
+    object (spatial index and nodes lookup included) can be saved with 
+    save() and loaded back with ConnectPoints.load().
+    
     Parameters
     -----------
     
@@ -89,14 +213,36 @@ class ConnectPoints:
         - the max length (in meters) of a POI connection edge, POIs with
           connection edge beyond this length will be removed.
     - knn (int): 
-        - k nearest neighbors to query for the nearest edge.
-          Consider increasing this number up to 10 if the connection
-          output is slightly unreasonable. But higher knn number will
-          slow down the process.
+        - kept for backward compatibility, not used anymore: the nearest
+          edge is now found with an exact nearest query on the STRtree
+          (see find_kne)
     - distance(int):
         - distance reachable in 60 minutes
         - required to measure the time distance of an edge
         - default: 5000 (meters)
+    - tolerance(float):
+        - snapping tolerance (in meters) used to resolve edges' endpoints
+          to nodes, to merge near-duplicate nodes and to ignore split 
+          positions too close to each other
+        - default: 1e-6
+    - merge_distance(float):
+        - if set, access points projected on the same edge with projected 
+          points closer than merge_distance (in meters, along the edge) 
+          are merged into one access point (the closest to the edge). 
+          The mapping between original points and kept access points is 
+          available in the merged_points attribute (DataFrame)
+        - default: None (no merge)
+    - workers(int):
+        - number of processes used to find the nearest edges. If > 1, the 
+          points extent is tiled (tile_size) and each tile (its points and 
+          the edges within tile + threshold halo) is processed in a process
+          pool. Splitting edges and making connections are then done once
+          for all tiles, so node ids are globally unique and results 
+          do not depend on the partition.
+        - default: 1
+    - tile_size(float):
+        - tile width (in meters) for the partitioned mode
+        - default: None (about 4 tiles per worker)
 
     """
     
@@ -111,7 +257,11 @@ class ConnectPoints:
             path=None, 
             threshold=50, 
             knn=5,
-            distance=5000
+            distance=5000,
+            tolerance=1e-6,
+            merge_distance=None,
+            workers=1,
+            tile_size=None
             ):
         self.points = points
         self.nodes = nodes
@@ -127,22 +277,45 @@ class ConnectPoints:
         self.edge_highway = 'projected_footway'
         self.osmid_prefix = 9990000000 
         self.distance = distance
+        self.tolerance = tolerance
+        self.merge_distance = merge_distance
+        self.merged_points = None
+        self.workers = workers
+        self.tile_size = tile_size
+        self.n_pps = 0
+        
+        #Build STRtree (bulk loaded, tree positions refer to self.edges.index)
+        self.build_tree()
+        #Index graph nodes for tolerance-based lookups of edges' endpoints
+        self.node_index = NodeIndex(self.nodes, tolerance=self.tolerance)
+        
+    def build_tree(self):
+        """
+        Description
+        ------------
         
-        #Build Rtree
-        self.Rtree = rtree.index.Index()
-        [self.Rtree.insert(
-                fid, 
-                geom.bounds
-                ) for fid, geom in self.edges['geometry'].iteritems()];
-        
+        Bulk load the STRtree of the current edges (connection edges 
+        excluded: points are only connected to the network edges)
+        """
+        if 'highway' in self.edges.columns:
+            network = self.edges.loc[
+                    self.edges['highway'] != self.edge_highway, 
+                    'geometry'
+                    ]
+        else:
+            network = self.edges['geometry']
+        self.tree = STRtree(np.asarray(network))
+        self.tree_labels = network.index.values
+    
     
     def update_nodes_process(self):
         """
         Description
         ------------
         
-        Update the NetworkX Graph object with input nodes and nodes created
-        during the splitting edges operation
+        Get the new nodes: access nodes (input points) and nodes created 
+        by projecting them on the edges (pp). New nodes are stored in 
+        self.new_nodes, they are appended to self.nodes in process().
         
         Returns
         --------
@@ -154,67 +327,98 @@ class ConnectPoints:
         
         None
         """
-        #Update nodes with new access nodes
-        self.nodes, self.new_nodes = self.update_nodes(
-                self.nodes, 
-                self.points,
-                ptype = "access"
+        # locate nearest edge (kne) and projected point (pp)
+        if self.workers > 1:
+            kne_idx, kne_dist = self.find_kne_partitioned(
+                    self.points['geometry']
+                    )
+        else:
+            kne_idx, kne_dist = self.find_kne(self.points['geometry'])
+        self.points['kne_idx'] = kne_idx
+        self.points['kne_dist'] = kne_dist
+        
+        #Get non-valid nodes list 
+        ##(nodes not used because too far from network)
+        valid = kne_dist <= self.threshold
+        self.non_valid_nodes = self.points.loc[
+                ~valid, 
+                self.key_col
+                ].astype(str).to_list()
+        n = len(valid)
+        n_fault = n - valid.sum()
+        logger.info(
+                "Remove faulty projections: {}/{} ({:.2f}%)".format(
+                n_fault,
+                n,
+                n_fault / max(n, 1) * 100
                 )
+        )
+        self.points = self.points.loc[valid]
         
-        #Update nodes with new created nodes (interpolated points)
-        # locate nearest edge (kne) and projected point (pp)
-        self.points['near_idx'] = [
-                list(
-                        self.Rtree.nearest(point.bounds, self.knn)
-                        ) for point in self.points['geometry']
-                ]  # slow
-        self.points['near_lines'] = [
-                self.edges['geometry'][near_idx] for near_idx in
-                                    self.points['near_idx']
-                                    ]  # very slow
-        self.points['kne_idx'], knes = zip(
-            *[
-                    self.find_kne(
-                            point, 
-                            near_lines
-                            ) for point, near_lines in
-              zip(
-                      self.points['geometry'], 
-                      self.points['near_lines']
-                      )
-              ]
-            )  # slow
-        self.points['pp'] = [
-                self.get_pp(
-                        point, 
-                        kne
-                        ) for point, kne in
-                            zip(
-                                    self.points['geometry'], 
-                                    knes
-                                    )
-                            ]
-        
-        self.nodes, self.new_nodes = self.update_nodes(
-                self.nodes, 
-                list(self.points['pp']),
-                ptype='pp'
+        knes = self.edges['geometry'].loc[self.points['kne_idx']].values
+        self.points['pp_dist'], self.points['pp'] = self.get_pp(
+                self.points['geometry'].values, 
+                knes
                 )
-        nodes_coord = self.nodes['geometry'].map(lambda x: x.coords[0])
-        self.nodes_id_dict = dict(
-                zip(
-                        nodes_coord, 
-                        self.nodes['osmid'].astype('str')
-                        )
+        
+        if self.merge_distance is not None:
+            self.points = self.merge_points(self.points)
+        
+        # pps closer than tolerance to a node (or to each other) are merged
+        pp_ids = (
+                self.osmid_prefix + self.n_pps + np.arange(len(self.points))
+                ).astype(str)
+        self.n_pps += len(pp_ids)
+        self.points['pp_osmid'] = self.node_index.add(
+                self.points['pp'].values, 
+                pp_ids
+                )
+        new_pps = self.points['pp_osmid'].values == pp_ids
+        self.n_merged_pps = len(pp_ids) - new_pps.sum()
+        
+        #New nodes: access nodes then pps nodes
+        n_access = len(self.points)
+        n_pps = new_pps.sum()
+        self.new_nodes = gpd.GeoDataFrame(
+                {
+                        'osmid': np.concatenate(
+                                [
+                                        self.points[self.key_col].astype(
+                                                str
+                                                ).values,
+                                        pp_ids[new_pps]
+                                        ]
+                                ),
+                        'access_type': np.repeat(
+                                [self.access_type, None], 
+                                [n_access, n_pps]
+                                ),
+                        'highway': np.repeat(
+                                [self.node_highway_access, self.node_highway_pp],
+                                [n_access, n_pps]
+                                )
+                        },
+                geometry=np.concatenate(
+                        [
+                                self.points['geometry'].values, 
+                                self.points['pp'].values[new_pps]
+                                ]
+                        ),
+                crs=self.nodes.crs
                 )
+        self.new_nodes['x'] = shapely.get_x(self.new_nodes['geometry'].values)
+        self.new_nodes['y'] = shapely.get_y(self.new_nodes['geometry'].values)
                 
     def update_edges_process(self):
         """
         Description
         ------------
         
-        Update the NetworkX Graph object with edges created
-        during the splitting edges operation
+        Get the new edges: segments of the edges split by the pps (they 
+        inherit the attributes of the split edge) and connection edges 
+        between access nodes and pps. New edges are stored in 
+        self.new_edges and index labels of split edges in 
+        self.removed_edges, self.edges is updated in process().
         
         Returns
         --------
@@ -226,260 +430,519 @@ class ConnectPoints:
         
         None
         """
-        #Update existing edges 
-        ## Split edges to segments
-        self.line_pps_dict = {
-                k: MultiPoint(list(v)) for k, v in
-                     self.points.groupby(['kne_idx'])['pp']
-                     }
-        new_lines = [
-                self.split_line(
-                        self.edges['geometry'][idx], 
-                        pps
-                        ) for idx, pps in self.line_pps_dict.items()]  # bit slow
-        self.edges, self.new_edges = self.update_edges(
-                self.edges, 
-                new_lines, 
-                replace=True
+        ## Split edges to segments at the projected points positions
+        segments_kne_idx, segments = self.split_lines(
+                self.points['kne_idx'].values,
+                self.points['pp_dist'].values,
+                self.points['pp'].values
                 )
-        # Update external edges (projected footways connected to pois)
-        # establish new_edges
-        pps_gdf = self.nodes[self.nodes['highway'] == self.node_highway_pp]
-        new_lines = [
-                LineString([p1, p2]) for p1, p2 in zip(
-                        self.points['geometry'], 
-                        pps_gdf['geometry']
-                        )
+        self.removed_edges = np.unique(segments_kne_idx)
+        cols = [
+                col for col in self.edges.columns if col not in 
+                ['geometry', 'source', 'target', 'length', 'time', 'osmid']
                 ]
-        self.edges, self.new_edges = self.update_edges(
-                self.edges, 
-                new_lines, 
-                replace=False
+        split_edges = pd.DataFrame(self.edges.loc[segments_kne_idx, cols])
+        split_edges.reset_index(drop=True, inplace=True)
+        
+        ## External edges (projected footways connected to pois)
+        connectors = self.get_connectors(
+                self.points['geometry'].values, 
+                self.points['pp'].values
+                )
+        connection_edges = pd.DataFrame(
+                {
+                        self.key_col: self.points[self.key_col].values,
+                        'oneway': False,
+                        'highway': self.edge_highway
+                        }
                 )
         
-    def find_kne(self, point, lines):
+        new_lines = np.concatenate([segments, connectors])
+        new_edges = gpd.GeoDataFrame(
+                pd.concat(
+                        [split_edges, connection_edges], 
+                        ignore_index=True, 
+                        sort=False
+                        ),
+                geometry=new_lines,
+                crs=self.edges.crs
+                )
+        
+        # resolve segments' endpoints to nodes (graph nodes or pps), 
+        ## connection edges link access nodes to their pp
+        new_edges['source'] = np.concatenate(
+                [
+                        self.node_index.resolve(
+                                shapely.get_point(segments, 0)
+                                ),
+                        self.points[self.key_col].astype(str).values
+                        ]
+                )
+        new_edges['target'] = np.concatenate(
+                [
+                        self.node_index.resolve(
+                                shapely.get_point(segments, -1)
+                                ),
+                        self.points['pp_osmid'].values
+                        ]
+                )
+        new_edges['osmid'] = new_edges['source'] + '_' + new_edges['target']
+        
+        # update features
+        new_edges['length'] = shapely.length(new_lines)
+        ## add walkable time
+        meters_per_minute = self.distance/60
+        new_edges['time'] = new_edges['length'] / meters_per_minute
+        
+        # remember to reindex to prevent duplication when concat
+        start = self.edges.index.max() + 1
+        new_edges.index = range(start, start + len(new_edges))
+        
+        self.new_edges = new_edges
+        
+    def find_kne(self, points):
         """
+        Description
+        ------------
+        
+        Find the nearest edge (kne) of each point with a single bulk 
+        nearest query on the STRtree (exact distances, no knn candidates)
         
+        Returns
+        --------
+        
+        - kne_idx (Numpy array): index labels (self.edges) of nearest edges
+        - kne_dist (Numpy array): distances between points and nearest edges
+        
+        Parameters
+        -----------
+        
+        - points (GeoSeries or array of Shapely Points)
         """
-        dists = np.array(
-                list(
-                        map(
-                                lambda l: l.distance(point), 
-                                lines
-                                )
-                        )
+        kne_pos, kne_dist = _query_nearest(self.tree, points)
+        kne_idx = self.tree_labels[kne_pos]
+        
+        return kne_idx, kne_dist
+    
+    def find_kne_partitioned(self, points):
+        """
+        Description
+        ------------
+        
+        Same as find_kne but points are partitioned in tiles processed in 
+        a pool of self.workers processes. Each tile gets the edges 
+        intersecting its extent enlarged by self.threshold: for any point 
+        with an edge closer than threshold, the nearest edge is found. 
+        Farther points get a distance > threshold (they are filtered). 
+        Points of tiles without any edge get their nearest edge from a 
+        global query (find_kne). Results are stitched back in points order.
+        Only the nearest edge query runs in the pool: projections, 
+        connectors and splits are done once for all points afterwards.
+        
+        Returns
+        --------
+        
+        - kne_idx (Numpy array): index labels (self.edges) of nearest edges
+        - kne_dist (Numpy array): distances between points and nearest edges
+        
+        Parameters
+        -----------
+        
+        - points (GeoSeries or array of Shapely Points)
+        """
+        points = np.asarray(points)
+        if len(points) == 0:
+            return self.find_kne(points)
+        
+        xy = shapely.get_coordinates(points)
+        origin = xy.min(axis=0)
+        tile_size = self.tile_size
+        if tile_size is None:
+            extent = (xy.max(axis=0) - origin).max()
+            tile_size = max(extent / np.sqrt(4 * self.workers), 1.0)
+        
+        #Tile of each point and edges (tree positions) of each tile
+        cells = np.floor((xy - origin) / tile_size).astype(np.int64)
+        tiles, tile_of_point = np.unique(cells, axis=0, return_inverse=True)
+        tile_of_point = tile_of_point.ravel()
+        mins = origin + tiles * tile_size - self.threshold
+        maxs = origin + (tiles + 1) * tile_size + self.threshold
+        tile_pos, edge_pos = self.tree.query(
+                shapely.box(mins[:, 0], mins[:, 1], maxs[:, 0], maxs[:, 1])
                 )
-        kne_pos = dists.argsort()[0]
-        kne = lines.iloc[[kne_pos]]
-        kne_idx = kne.index[0]
+        edges_order = np.argsort(tile_pos, kind="stable")
+        tile_pos = tile_pos[edges_order]
+        edge_pos = edge_pos[edges_order]
+        
+        points_order = np.argsort(tile_of_point, kind="stable")
+        points_split = np.cumsum(np.bincount(tile_of_point))[:-1]
+        edges_split = np.cumsum(np.bincount(tile_pos, minlength=len(tiles)))[:-1]
+        edges = self.tree.geometries
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            results = list(
+                    executor.map(
+                            _find_kne_tile,
+                            np.split(points[points_order], points_split),
+                            [edges[pos] for pos in np.split(edge_pos, edges_split)],
+                            [
+                                    self.tree_labels[pos] for pos in 
+                                    np.split(edge_pos, edges_split)
+                                    ]
+                            )
+                    )
+        
+        kne_idx = np.empty(len(points), dtype=self.tree_labels.dtype)
+        kne_dist = np.empty(len(points), dtype=np.float64)
+        kne_idx[points_order] = np.concatenate([r[0] for r in results])
+        kne_dist[points_order] = np.concatenate([r[1] for r in results])
         
-        return kne_idx, kne.values[0]
+        #Points of tiles without edges: global nearest query
+        no_edge = np.isinf(kne_dist)
+        if no_edge.any():
+            kne_idx[no_edge], kne_dist[no_edge] = self.find_kne(
+                    points[no_edge]
+                    )
+        
+        logger.info(
+                "Partitioned nearest edges: {} tiles, {} workers".format(
+                len(tiles),
+                self.workers
+                )
+        )
+        
+        return kne_idx, kne_dist
     
-    def get_pp(self, point, line):
+    def merge_points(self, points):
         """
         Description
         ------------
         
-        Get the projected point (pp) of 'point' on 'line'.
+        Merge the points projected on the same edge whose projected points
+        are closer than self.merge_distance along this edge (chained). 
+        Each group of merged points is represented by its point closest to 
+        the edge.
         
         Returns
         --------
         
-        Projected points
+        Points GeoDataFrame with only representative points. 
+        Add merged_points (DataFrame) to the class object: key_col of each 
+        input point and key_col of its representative point ("access_id")
         
         Parameters
         -----------
         
-        - point(Shapely Point object):
-            - Point
-        - line(Shapely LineString object):
-            - LineString
+        - points (GeoDataFrame):
+            - points with 'kne_idx', 'kne_dist' and 'pp_dist' columns
         """
+        keys = points[self.key_col].values
+        #No point to merge (empty input or all points beyond threshold)
+        if len(points) == 0:
+            self.merged_points = pd.DataFrame(
+                    {
+                            self.key_col: keys,
+                            "access_id": keys
+                            }
+                    )
+            return points
         
-        # project new Point to be interpolated
-        pp = line.interpolate(line.project(point))  # PP as a Point
-        return pp
-
-    def split_line(self, line, pps):
+        kne_idx = points['kne_idx'].values
+        pp_dist = points['pp_dist'].values
+        
+        #Sort along edges and start a new group on each new edge or gap
+        order = np.lexsort((pp_dist, kne_idx))
+        new_group = np.ones(len(order), dtype=bool)
+        new_group[1:] = (kne_idx[order][1:] != kne_idx[order][:-1]) | (
+                np.diff(pp_dist[order]) > self.merge_distance
+                )
+        group = np.empty(len(order), dtype=np.int64)
+        group[order] = np.cumsum(new_group) - 1
+        
+        #Representative: point with the shortest connection in its group
+        by_dist = np.lexsort((points['kne_dist'].values, group))
+        first = np.ones(len(by_dist), dtype=bool)
+        first[1:] = group[by_dist][1:] != group[by_dist][:-1]
+        representative = np.empty(group.max() + 1, dtype=np.int64)
+        representative[group[by_dist][first]] = by_dist[first]
+        
+        self.merged_points = pd.DataFrame(
+                {
+                        self.key_col: keys, 
+                        "access_id": keys[representative[group]]
+                        }
+                )
+        logger.info(
+                "Merge access points: {} merged into {}".format(
+                len(points),
+                len(representative)
+                )
+        )
+        
+        return points.iloc[np.sort(representative)]
+    
+    def get_pp(self, points, lines):
         """
         Description
         ------------
         
-        Split 'line' by all intersecting 'pps' (as multipoint)
+        Get the projected points (pp) of 'points' on 'lines' (aligned 
+        arrays, points[i] is projected on lines[i]).
         
         Returns
         --------
         
-        New_lines (list): a list of all line segments after the split
+        - pp_dist (Numpy array): linear reference of the projected points 
+        along their line
+        - pps (Numpy array): projected points (Shapely Points)
         
         Parameters
         -----------
         
-        None
+        - points(array of Shapely Points):
+            - Points
+        - lines(array of Shapely LineStrings):
+            - LineStrings
         """
         
-        """.
-        Returns:
-            
+        # project new Points to be interpolated
+        pp_dist = shapely.line_locate_point(lines, points)
+        pps = shapely.line_interpolate_point(lines, pp_dist)
+        return pp_dist, pps
+    
+    def get_connectors(self, points, pps):
         """
-        # IMPORTANT FIX for ensuring intersection between splitters and the line
-        # but no need for updating edges_meter manually because the old lines will be
-        # replaced anyway
-        line = snap(line, pps, 1e-8)  # slow?
+        Description
+        ------------
+        
+        Build the connection edges between 'points' and their projected 
+        points 'pps' (aligned arrays)
+        
+        Returns
+        --------
+        
+        Connection edges (array of Shapely LineStrings)
+        
+        Parameters
+        -----------
+        
+        - points(array of Shapely Points)
+        - pps(array of Shapely Points)
+        """
+        coords = np.stack(
+                [
+                        shapely.get_coordinates(points), 
+                        shapely.get_coordinates(pps)
+                        ],
+                axis=1
+                )
+        return shapely.linestrings(coords)
 
-        try:
-            new_lines = list(split(line, pps))  # split into segments
-            return new_lines
-        except TypeError as e:
-            logger.info('Error when splitting line: {}\n{}\n{}\n'.format(e, line, pps))
-            return []
+    def split_lines(self, kne_idx, pp_dist, pps):
+        """
+        Description
+        ------------
+        
+        Split the edges hit by projected points (pps) by cutting their 
+        coordinates arrays at the linear references of the pps (no GEOS
+        overlay operation). Cut points closer than self.tolerance to
+        an edge extremity or to another cut point of the same edge are 
+        ignored. Edges without any remaining cut point are not split.
+        
+        Returns
+        --------
+        
+        - segments_kne_idx (Numpy array): index label (self.edges) of the 
+        split edge of each segment
+        - segments (Numpy array): a flat array of all the line segments
+        
+        Parameters
+        -----------
+        
+        - kne_idx (Numpy array):
+            - index label of the nearest edge of each pp
+        - pp_dist (Numpy array):
+            - linear reference of each pp along its nearest edge
+        - pps (Numpy array):
+            - projected points (Shapely Points)
+        """
+        tol = self.tolerance
+        
+        #Get the coordinates of all the hit edges as one flat array and the 
+        ## cumulative length of each vertex (not increasing between edges)
+        lines_idx, cut_line = np.unique(kne_idx, return_inverse=True)
+        lines = self.edges['geometry'].loc[lines_idx].values
+        coords, coords_line = shapely.get_coordinates(
+                lines, 
+                return_index=True
+                )
+        seg_len = np.hypot(*np.diff(coords, axis=0).T)
+        seg_len[coords_line[1:] != coords_line[:-1]] = 0.0
+        cum = np.concatenate([[0.0], np.cumsum(seg_len)])
+        starts = np.searchsorted(coords_line, np.arange(len(lines)))
+        ends = np.append(starts[1:], len(coords))
+        lengths = cum[ends - 1] - cum[starts]
+        
+        #Sort cut points along each edge, keep the ones strictly inside the 
+        ## edge and drop duplicated positions
+        order = np.lexsort((pp_dist, cut_line))
+        cut_line = cut_line[order]
+        cut_dist = pp_dist[order]
+        cut_coords = shapely.get_coordinates(pps)[order]
+        inside = (cut_dist > tol) & (cut_dist < lengths[cut_line] - tol)
+        cut_line = cut_line[inside]
+        cut_dist = cut_dist[inside]
+        cut_coords = cut_coords[inside]
+        unique = np.ones(len(cut_line), dtype=bool)
+        unique[1:] = (cut_line[1:] != cut_line[:-1]) | (
+                np.diff(cut_dist) > tol
+                )
+        cut_line = cut_line[unique]
+        cut_dist = cut_dist[unique] + cum[starts][cut_line]
+        cut_coords = cut_coords[unique]
+        
+        #Each split edge with m cut points gives m+1 segments: segment j 
+        ## goes from cut j-1 (or first vertex) to cut j (or last vertex)
+        n_cuts = np.bincount(cut_line, minlength=len(lines))
+        split = np.flatnonzero(n_cuts)
+        n_segs = n_cuts[split] + 1
+        seg_line = np.repeat(split, n_segs)
+        first_seg = np.cumsum(n_segs) - n_segs
+        seg_rank = np.arange(len(seg_line)) - np.repeat(first_seg, n_segs)
+        first_cut = np.cumsum(n_cuts) - n_cuts
+        head_cut = first_cut[seg_line] + seg_rank - 1
+        tail_cut = first_cut[seg_line] + seg_rank
+        has_head = seg_rank > 0
+        has_tail = seg_rank < n_cuts[seg_line]
+        lo = np.where(
+                has_head,
+                np.searchsorted(cum, cut_dist[np.maximum(head_cut, 0)], 'right'),
+                starts[seg_line]
+                )
+        hi = np.where(
+                has_tail,
+                np.searchsorted(
+                        cum, 
+                        cut_dist[np.minimum(tail_cut, len(cut_dist) - 1)], 
+                        'left'
+                        ),
+                ends[seg_line]
+                )
+        
+        #Gather the coordinates of each segment: head cut point, inner 
+        ## vertices, tail cut point (cut points are stored after vertices)
+        counts = has_head + (hi - lo) + has_tail
+        seg_id = np.repeat(np.arange(len(seg_line)), counts)
+        pos = np.arange(len(seg_id)) - np.repeat(np.cumsum(counts) - counts, counts)
+        src = lo[seg_id] + pos - has_head[seg_id]
+        src = np.where(
+                has_head[seg_id] & (pos == 0), 
+                len(coords) + head_cut[seg_id], 
+                src
+                )
+        src = np.where(
+                has_tail[seg_id] & (pos == counts[seg_id] - 1),
+                len(coords) + tail_cut[seg_id],
+                src
+                )
+        segments = shapely.linestrings(
+                np.concatenate([coords, cut_coords])[src], 
+                indices=seg_id
+                )
+        
+        return lines_idx[seg_line], segments
 
-    def update_nodes(self, nodes, new_points, ptype):
+    def apply(self):
         """
         Description:
         ------------
-        Update nodes with a list (pp) or a GeoDataFrame (access) of new_points.
+        
+        Append all new nodes and edges to self.nodes and self.edges in one
+        operation (removing split edges) and update the STRtree
+        
+        Returns:
+        --------
+        
+        Delta namedtuple (added_nodes, removed_nodes, added_edges, 
+        removed_edges)
+        """
+        delta = Delta(
+                self.new_nodes, 
+                [], 
+                self.new_edges, 
+                self.removed_edges
+                )
+        self.nodes, self.edges = apply_delta(self.nodes, self.edges, delta)
+        self.build_tree()
+        
+        return delta
+    
+    def connect(self, points):
+        """
+        Description:
+        ------------
+        
+        Connect new points to the graph already updated by process() (or by 
+        a previous connect()). Only the new points are projected and only 
+        the edges they hit are split. self.nodes and self.edges are updated.
+        
+        Returns:
+        --------
+        
+        Delta namedtuple to apply to the previous graph (see apply_delta):
+            - added_nodes (GeoDataFrame)
+            - removed_nodes (list of osmid)
+            - added_edges (GeoDataFrame)
+            - removed_edges (index labels of split edges)
         
         Parameters:
         -----------
-        - ptype(str): 
-            - type of Point list to append, 'pp' or 'access'
+        
+        - points (GeoDataFrame):
+            - new points (same key_col and projection than the first ones)
         """
-        # create gdf of new nodes (projected PAPs)
-        if ptype == 'pp':
-            new_nodes = gpd.GeoDataFrame(new_points, columns=['geometry'],
-                                         crs=self.points.crs)
-            n = len(new_nodes)
-            new_nodes['highway'] = self.node_highway_pp
-            new_nodes['osmid'] = [str(self.osmid_prefix + i) for i in range(n)]
-
-        # create gdf of new nodes
-        elif ptype == 'access':
-            new_nodes = new_points[['geometry', self.key_col]]
-            new_nodes.columns = ['geometry', 'osmid']
-            new_nodes['access_type'] = self.access_type
-            new_nodes['highway'] = self.node_highway_access
-            new_nodes['osmid'] = new_nodes['osmid'].astype(str)
-
-        else:
-            logger.info("Unknown ptype when updating nodes.")
-
-        # merge new nodes (it is safe to ignore the index for nodes)
-        gdfs = [nodes, new_nodes]
-        nodes = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True, sort=False),
-                                 crs=gdfs[0].crs)
-
-        return nodes, new_nodes  # all nodes, newly added nodes only
-
-    def update_edges(self, edges, new_lines, replace):
+        self.points = points
+        self.update_nodes_process()
+        self.update_edges_process()
+        
+        return self.apply()
+    
+    def save(self, path):
         """
         Description:
         ------------
         
-        Update edge info by adding new_lines; or,
-        replace existing ones with new_lines (n-split segments).
+        Save the object (graph, STRtree and nodes lookup) with pickle
         
         Parameters:
         -----------
-        - edges(DataFrame):
-            - Edges DataFrame
-        - new_lines(list):
-            - list of new lines to add
-        - replace: 
-            -treat new_lines (flat list) as newly added edges if False,
-            else replace existing edges with new_lines (often a nested list)
-        
-        Note:
-            kne_idx refers to 'fid in Rtree'/'label'/'loc', not positional iloc
+        
+        - path (str):
+            - complete path file name
         """
-        # for interpolation (split by pp): replicate old line
-        if replace:
-            # create a flattened gdf with all line segs and corresponding kne_idx
-            kne_idxs = list(self.line_pps_dict.keys())
-            lens = [len(item) for item in new_lines]
-            new_lines_gdf = gpd.GeoDataFrame(
-                {
-                        'kne_idx': np.repeat(
-                                kne_idxs, 
-                                lens
-                                ),
-                        'geometry': list(
-                                itertools.chain.from_iterable(new_lines)
-                                )
-                        }
-                )
-            # merge to inherit the data of the replaced line
-            cols = list(edges.columns)
-            cols.remove('geometry')  # don't include the old geometry
-            new_edges = new_lines_gdf.merge(
-                    edges[cols], 
-                    how='left', 
-                    left_on='kne_idx', 
-                    right_index=True
-                    )
-            new_edges.drop('kne_idx', axis=1, inplace=True)
-            new_lines = new_edges['geometry']  # now a flatten list
-        # for connection (to external poi): append new lines
-        else:
-            new_edges = gpd.GeoDataFrame(
-                    self.points[[self.key_col]], 
-                    geometry=new_lines,
-                    columns=[self.key_col, 'geometry']
-                    )
-            new_edges['oneway'] = False
-            new_edges['highway'] = self.edge_highway
-
-        # update features (a bit slow)
-        new_edges['length'] = [l.length for l in new_lines]
-        ## add walkable time
-        meters_per_minute = self.distance/60
-        new_edges['time'] = [l.length / meters_per_minute for l in new_lines]
-        
-        new_edges['source'] = new_edges['geometry'].map(
-            lambda x: self.nodes_id_dict.get(list(x.coords)[0], 'None'))
-        new_edges['target'] = new_edges['geometry'].map(
-            lambda x: self.nodes_id_dict.get(list(x.coords)[-1], 'None'))
-        new_edges['osmid'] = ['_'.join(s) for s in zip(new_edges['source'],
-                                                       new_edges['target'])]
-
-        # remember to reindex to prevent duplication when concat
-        start = edges.index[-1] + 1
-        stop = start + len(new_edges)
-        new_edges.index = range(start, stop)
-
-        # for interpolation: remove existing edges
-        if replace:
-            edges = edges.drop(kne_idxs, axis=0)
-        # for connection: filter invalid links
-        else:
-            #Get non-valid nodes list 
-            ##(nodes not used because too far from network)        
-            non_valid = np.where(new_edges['length'] > self.threshold)[0]
-            self.non_valid_nodes = new_edges.iloc[non_valid]["unique_id"].to_list()
-            
-            #Get valid edges
-            valid_pos = np.where(new_edges['length'] <= self.threshold)[0]
-            n = len(new_edges)
-            n_fault = n - len(valid_pos)
-            f_pct = n_fault / n * 100
-            logger.info(
-                    "Remove faulty projections: {}/{} ({:.2f}%)".format(
-                    n_fault,
-                    n,
-                    f_pct
-                    )
-            )
-            
-            new_edges = new_edges.iloc[valid_pos]  # use 'iloc' here
-                    
-
-        # merge new edges
-        dfs = [edges, new_edges]
-        edges = gpd.GeoDataFrame(pd.concat(dfs, ignore_index=False, sort=False),
-                                 crs=dfs[0].crs)
-
-        # all edges, newly added edges only
-        return edges, new_edges
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+    
+    @classmethod
+    def load(cls, path):
+        """
+        Description:
+        ------------
+        
+        Load an object saved with save()
+        
+        Returns:
+        --------
+        
+        ConnectPoints object
+        
+        Parameters:
+        -----------
+        
+        - path (str):
+            - complete path file name
+        """
+        with open(path, "rb") as f:
+            return pickle.load(f)
     
     def process(self):
         """
@@ -488,48 +951,35 @@ class ConnectPoints:
         
         Run the complete process
         """
-        self.non_valid_nodes = [] #required to filter too far nodes
         self.update_nodes_process()
         self.update_edges_process()
         
-        self.nodes['x'] = [p.x for p in self.nodes['geometry']]
-        self.nodes['y'] = [p.y for p in self.nodes['geometry']]
+        self.apply()
+        
+        self.nodes['x'] = shapely.get_x(self.nodes['geometry'].values)
+        self.nodes['y'] = shapely.get_y(self.nodes['geometry'].values)
         
-        # edges.reset_index(drop=True, inplace=True)
         self.edges['length'] = self.edges['length'].astype(float)
         self.edges['source'] = self.edges['source'].astype(str) 
         self.edges['target'] = self.edges['target'].astype(str)
         self.nodes['osmid'] = self.nodes['osmid'].astype(str)
         
         # report issues
-        # - examine key duplication
-        if len(self.nodes) != len(self.nodes_id_dict):
-            key_duplication = "NOTE: duplication in node coordinates keys"
-            key_duplication += "Nodes count: " + str(
-                    len(self.nodes)
-                    )
-            key_duplication += "Node coordinates key count: " + str(
-                            len(self.nodes_id_dict)
-                            )
-            logger.info(key_duplication)
+        # - examine merged nodes (pps within tolerance of another node)
+        if self.n_merged_pps > 0:
+            merged_nodes = "NOTE: projected points merged with existing nodes "
+            merged_nodes += "(tolerance: " + str(self.tolerance) + "): "
+            merged_nodes += str(self.n_merged_pps)
+            logger.info(merged_nodes)
         # - examine missing nodes
         missing_nodes = "MISSING NODES: \n"
         missing_nodes += "Missing 'from' nodes: " + str(
-                        len(self.edges[self.edges['source'] == 'None'])
+                        (self.new_edges['source'] == 'None').sum()
                         )
         missing_nodes += "\nMissing 'target' nodes: " + str(
-                len(
-                        self.edges[self.edges['target'] == 'None']
-                        )
+                (self.new_edges['target'] == 'None').sum()
                 )
         logger.info(missing_nodes)
-        
-        #Remove non valid nodes
-        self.nodes = self.nodes.loc[
-                ~self.nodes["osmid"].isin(
-                        self.non_valid_nodes
-                        )
-                ]
     
         # save and return
         if self.path:
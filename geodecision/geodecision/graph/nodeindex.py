@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Spatial lookup of graph nodes ids from coordinates
+
+@author: thomas
+"""
+
+import numpy as np
+from shapely import STRtree
+
+
+class NodeIndex:
+    """
+    Description
+    ------------
+
+    Spatial lookup of nodes ids with a snapping tolerance: any point closer
+    than 'tolerance' to an indexed node resolves to the id of this node
+    (nearest one if several). Lookups are done in batch on arrays of points.
+    Added nodes are indexed in a separate small tree (rebuilt on each add)
+    which is merged into the main tree once it is larger than it, so adding
+    a batch does not rebuild the tree of all nodes.
+
+    Returns
+    --------
+
+    NodeIndex object
+
+    Parameters
+    -----------
+
+    - nodes (GeoDataFrame):
+        - GDF of nodes (geom: Point)
+    - id_column (str):
+        - name of the column with nodes ids
+        - default: "osmid"
+    - tolerance (float):
+        - snapping tolerance (in CRS unit)
+        - default: 1e-6
+    """
+
+    def __init__(self, nodes, id_column="osmid", tolerance=1e-6):
+        self.tolerance = tolerance
+        self.geometries = np.asarray(nodes["geometry"], dtype=object)
+        self.ids = nodes[id_column].astype(str).values.astype(object)
+        self.tree = STRtree(self.geometries)
+        self.n_indexed = len(self.geometries)
+        self.added_tree = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def resolve(self, points, missing="None"):
+        """
+        Description
+        ------------
+
+        Get the id of the nearest node (within tolerance) of each point
+
+        Returns
+        --------
+
+        Numpy array of nodes ids ('missing' when no node within tolerance)
+
+        Parameters
+        -----------
+
+        - points (array of Shapely Points)
+        - missing (str):
+            - value for points without node
+            - default: "None"
+        """
+        points = np.asarray(points, dtype=object)
+        ids = np.full(len(points), missing, dtype=object)
+        if len(self) == 0 or len(points) == 0:
+            return ids
+        distances = np.full(len(points), np.inf)
+        for tree, offset in (
+                (self.tree, 0),
+                (self.added_tree, self.n_indexed)
+                ):
+            if tree is None:
+                continue
+            (points_pos, nodes_pos), dists = tree.query_nearest(
+                    points,
+                    max_distance=self.tolerance,
+                    return_distance=True,
+                    all_matches=False
+                    )
+            # Nearest node of both trees
+            closer = dists < distances[points_pos]
+            points_pos = points_pos[closer]
+            distances[points_pos] = dists[closer]
+            ids[points_pos] = self.ids[nodes_pos[closer] + offset]
+
+        return ids
+
+    def add(self, points, ids, merge=True):
+        """
+        Description
+        ------------
+
+        Add new nodes to the index. If merge is True, a new node closer than
+        tolerance to an indexed node (or to a previous new node) is not
+        added and resolves to the id of this node.
+
+        Returns
+        --------
+
+        Numpy array of the resolved ids of the new nodes (own id if added)
+
+        Parameters
+        -----------
+
+        - points (array of Shapely Points)
+        - ids (array of str):
+            - ids of the new nodes
+        - merge (bool):
+            - merge near-duplicates nodes
+            - default: True
+        """
+        points = np.asarray(points, dtype=object)
+        ids = np.asarray(ids).astype(str).astype(object)
+
+        if merge:
+            resolved = self.resolve(points, missing="")
+            new = np.flatnonzero(resolved == "")
+            # Near-duplicates among new nodes resolve to the first one
+            tree = STRtree(points[new])
+            pairs = tree.query(
+                    points[new],
+                    predicate="dwithin",
+                    distance=self.tolerance
+                    )
+            first = np.arange(len(new))
+            np.minimum.at(first, pairs[0], pairs[1])
+            while (first[first] != first).any():
+                first = first[first]
+            resolved[new] = ids[new][first]
+            added = new[first == np.arange(len(new))]
+        else:
+            resolved = ids
+            added = np.arange(len(points))
+
+        self.geometries = np.concatenate([self.geometries, points[added]])
+        self.ids = np.concatenate([self.ids, ids[added]])
+        # Only the small tree of added nodes is rebuilt, it is merged into
+        # the main tree when it gets larger (amortized rebuilds)
+        if len(self.geometries) - self.n_indexed > self.n_indexed:
+            self.tree = STRtree(self.geometries)
+            self.n_indexed = len(self.geometries)
+            self.added_tree = None
+        else:
+            self.added_tree = STRtree(self.geometries[self.n_indexed:])
+
+        return resolved
@@ -6,8 +6,10 @@ Created on Wed Sep 11 09:44:18 2019
 @author: thomas
 """
 
+import numpy as np
+import pandas as pd
 import geopandas as gpd
-from shapely.geometry import LineString
+import shapely
 
 class GetSplitNodes:
     """
@@ -20,7 +22,8 @@ class GetSplitNodes:
     --------
     
     Split points GeoPandas GeoDataFrame with unique id for each new points
-    in a specific column/Serie: "unique_id"
+    in a specific column/Serie: "unique_id" and the position of the 
+    polygon part (for MultiPolygons) of each point: "part_id"
     
     Parameters
     -----------
@@ -36,9 +39,31 @@ class GetSplitNodes:
         - List of columns name (columns that will be kept)
         - Default: []
         - If default, keep all columns but geometry column other than Points
+    - edges (GeoDataFrame):
+        - GDF of network edges (geom: LineString), same projection
+        - If set with threshold, only points closer than threshold to an 
+          edge are kept (points facing backyards or other buildings would 
+          be removed later by ConnectPoints threshold anyway)
+        - Default: None
+    - threshold (int):
+        - max distance (in meters) to an edge (see edges)
+        - Default: None
+    
+    Raises
+    -------
+    
+    ValueError if only one of edges and threshold is set
     """
     
-    def __init__(self, gdf_polys, dist_split, id_column, columns=[]):
+    def __init__(
+            self, 
+            gdf_polys, 
+            dist_split, 
+            id_column, 
+            columns=[], 
+            edges=None, 
+            threshold=None
+            ):
         """
         Init
         """
@@ -53,165 +78,132 @@ class GetSplitNodes:
         
         self.crs = self.gdf_polys.crs
         self.id = id_column
+        self.edges = edges
+        self.threshold = threshold
         
-#    def _loop_on_line(self):
-#        """
-#        Description
-#        ------------
-#        
-#        Split linestring and return a list of Shapely Points
-#        
-#        Returns
-#        --------
-#        
-#        Shapely MultiPoints
-#        
-#        Parameters
-#        -----------
-#        
-#        - line (Shapely LineString)
-#        """
-#        
-#        for i in range(len(self.line.coords[:-1])):
-#                line_tmp = LineString(
-#                        [
-#                                self.line.coords[i], 
-#                                self.line.coords[i+1]
-#                                ]
-#                        )
-#                nb_split = int(line_tmp.length//self.dist_split)
-#                if nb_split <= 1:
-#                    nb_split = 2
-#                    
-#                points.extend(
-#                        list(
-#                                [line_tmp.interpolate(
-#                                        (i/nb_split), 
-#                                        normalized=True
-#                                        ) for i in range(
-#                                                1, 
-#                                                nb_split
-#                                                )
-#                                ]
-#                            )
-#                        )
-        
-        
-    def _splitter(self, line):
+    def _get_boundary(self, polys):
         """
         Description
         ------------
         
-        Split linestring and return a list of Shapely Points
+        Get rings (exterior and interiors) of every part of the polygons
+        (all parts of MultiPolygons)
         
         Returns
         --------
         
-        Shapely MultiPoints
+        - rings (Numpy array of LinearRings)
+        - rings_part (Numpy array): position of the part of each ring
+        - parts_poly (Numpy array): position of the polygon of each part
         
         Parameters
         -----------
         
-        - line (Shapely LineString)
+        - polys (array of Shapely Polygons or MultiPolygons)
         """
+        parts, parts_poly = shapely.get_parts(
+                np.asarray(polys), 
+                return_index=True
+                )
+        rings, rings_part = shapely.get_rings(parts, return_index=True)
         
-        #Split each segment of the LineString in order to get at least
-        ## one potential connection point on each "side"
-        points = []
-        
-#        if isinstance(line, MultiLineString):
-#            for element in line:
-#                self.line = element
-#                self._loop_on_line()
-#        elif isinstance(line, LineString):
-#            self.line = element
-#            self._loop_on_line()
-#                
-#        
-#        if line:
-#            for i in range(len(line.coords[:-1])):
-#                line_tmp = LineString(
-#                        [
-#                                line.coords[i], line.coords[i+1]
-#                                ]
-#                        )
-#                nb_split = int(line_tmp.length//self.dist_split)
-#                if nb_split <= 1:
-#                    nb_split = 2
-#                    
-#                points.extend(
-#                        list(
-#                                [line_tmp.interpolate(
-#                                        (i/nb_split), 
-#                                        normalized=True
-#                                        ) for i in range(
-#                                                1, 
-#                                                nb_split
-#                                                )
-#                                ]
-#                            )
-#                        )
-#        except:
-#            print("OUPS")
-#            LINE = line
-#            print("IIIII")
-         #TODO: remove the following after above tested multiple times   
-        nb_split = int(line.length//self.dist_split)
-        #Manage when nb_split <= 1 to avoid further interpolation errors
-        
-        #TODO; try with a minimum of 4 splits. 
-        if nb_split <= 2: 
-            nb_split = 3
-        points = list(
-                            [line.interpolate(
-                                    (i/nb_split), 
-                                    normalized=True
-                                    ) for i in range(
-                                            1, 
-                                            nb_split
-                                            )
-                            ]
-                        )
-                            
-                            
-        
-#        if isinstance(line, MultiLineString):
-#            for element in line:
-#                points.extend(
-#                        [Point(x) for x in element.coords]
-#                        )
-#        elif isinstance(line, LineString):
-#            points.extend(
-#                    [Point(x) for x in line.coords]
-#                    )
-        
-        return points
+        return rings, rings_part, parts_poly
     
-    def _get_boundary(self, poly):
+    def _splitter(self, rings, rings_group, n_groups):
         """
         Description
         ------------
         
-        Get LineStrings of Polygon's exterior
+        Split the rings of each group (all rings of a group are measured as 
+        one line) with cumulative-length interpolation on coordinates arrays.
+        Each group gets nb_split - 1 points regularly spaced, nb_split being
+        length // dist_split (minimum 3) in order to get at least one 
+        potential connection point on each "side"
         
         Returns
         --------
         
-        List of LineStrings
+        - xy (Numpy array): coordinates of the points (n, 2)
+        - points_group (Numpy array): group of each point
         
         Parameters
         -----------
         
-        - poly (Shapely Polygon)
+        - rings (array of Shapely LinearRings)
+        - rings_group (Numpy array):
+            - group of each ring (sorted)
+        - n_groups (int):
+            - number of groups
         """
+        coords, coords_ring = shapely.get_coordinates(rings, return_index=True)
+        coords_group = rings_group[coords_ring]
         
-        if poly.geom_type == "Polygon":
-            boundary = poly.boundary
-        elif poly.geom_type == "MultiPolygon":
-            boundary = poly[0].boundary
-        return boundary
+        #Cumulative length of vertices (no length between rings)
+        seg_len = np.hypot(*np.diff(coords, axis=0).T)
+        seg_len[coords_ring[1:] != coords_ring[:-1]] = 0.0
+        cum = np.concatenate([[0.0], np.cumsum(seg_len)])
+        
+        groups = np.arange(n_groups)
+        first = np.searchsorted(coords_group, groups)
+        last = np.searchsorted(coords_group, groups, side="right") - 1
+        has_coords = last > first
+        first = np.minimum(first, len(cum) - 1)
+        lengths = np.where(has_coords, cum[last] - cum[first], 0.0)
+        
+        #Manage when nb_split <= 2 to avoid further interpolation errors
+        nb_split = (lengths // self.dist_split).astype(np.int64)
+        nb_split[nb_split <= 2] = 3
+        nb_points = np.where(has_coords, nb_split - 1, 0)
+        
+        #Points at i/nb_split (i in 1..nb_split-1) of the length of the group
+        points_group = np.repeat(groups, nb_points)
+        i = np.arange(len(points_group)) - np.repeat(
+                np.cumsum(nb_points) - nb_points, 
+                nb_points
+                ) + 1
+        target = cum[first[points_group]] + (
+                lengths[points_group] * i / nb_split[points_group]
+                )
+        #Segment ending at (or containing) the target: at the junction of 
+        ## two rings, the point is the end of the first ring (as interpolate 
+        ## on the boundary)
+        k = np.searchsorted(cum, target, side="left") - 1
+        k = np.clip(k, first[points_group], last[points_group] - 1)
+        seg = np.where(seg_len[k] > 0, seg_len[k], 1.0)
+        frac = np.clip((target - cum[k]) / seg, 0.0, 1.0)[:, None]
+        xy = coords[k] + frac * (coords[k + 1] - coords[k])
+        
+        return xy, points_group
+    
+    def _near_network(self, xy):
+        """
+        Description
+        ------------
+        
+        Check which points are closer than self.threshold to an edge of 
+        self.edges (bulk query on a STRtree of the edges)
+        
+        Returns
+        --------
+        
+        Boolean Numpy array
+        
+        Parameters
+        -----------
+        
+        - xy (Numpy array): coordinates of the points (n, 2)
+        """
+        tree = shapely.STRtree(np.asarray(self.edges["geometry"]))
+        points_pos, _ = tree.query(
+                shapely.points(xy), 
+                predicate="dwithin", 
+                distance=self.threshold
+                )
+        near = np.zeros(len(xy), dtype=bool)
+        near[points_pos] = True
+        
+        return near
         
-
     def get_split_nodes(self):
         """
         Description
@@ -225,33 +217,46 @@ class GetSplitNodes:
         Split points GeoPandas GeoDataFrame
         
         """
-        points_column = "points"
-        self.columns.append(points_column)
-        self.gdf_polys["boundary"] = self.gdf_polys["geometry"].map(
-                self._get_boundary
+        rings, rings_part, parts_poly = self._get_boundary(
+                self.gdf_polys["geometry"].values
                 )
-        self.gdf_polys[points_column] = self.gdf_polys["boundary"].map(
-                self._splitter
+        xy, points_part = self._splitter(rings, rings_part, len(parts_poly))
+        
+        #Keep only points that could be connected to the network
+        if (self.edges is None) != (self.threshold is None):
+            raise ValueError(
+                """
+                edges and threshold must be set together (edges: {}, 
+                threshold: {})
+                """.format(
+                "None" if self.edges is None else "set",
+                self.threshold
                 )
-        gdf_points = self.gdf_polys[self.columns]
-        gdf_points = gdf_points.explode(points_column).reset_index()
-        geometry = gdf_points[points_column]
-        del gdf_points[points_column]
+            )
+        if self.edges is not None:
+            near = self._near_network(xy)
+            xy = xy[near]
+            points_part = points_part[near]
+        
+        #Polygon of each point and position of the part in its polygon
+        points_poly = parts_poly[points_part]
+        first_part = np.searchsorted(parts_poly, parts_poly)
+        part_id = (np.arange(len(parts_poly)) - first_part)[points_part]
+        
         gdf_points = gpd.GeoDataFrame(
-                gdf_points,
-                geometry=geometry,
+                self.gdf_polys[self.columns].iloc[points_poly].reset_index(
+                        drop=True
+                        ),
+                geometry=shapely.points(xy),
                 crs=self.crs
                 )
+        gdf_points["part_id"] = part_id
         
         #Set a unique id based on index for future manipulations
-        gdf_points["index_tmp"] = [i for i in range(0,len(gdf_points))]
-        gdf_points["unique_id"] = gdf_points.apply(
-                lambda x: str(x[self.id]) + "_" + str(x["index_tmp"]),
-                axis=1
-                    )
-        
-        del gdf_points["index"]
-        del gdf_points["index_tmp"]        
+        gdf_points["unique_id"] = gdf_points[self.id].astype(str).str.cat(
+                pd.Series(np.arange(len(gdf_points))).astype(str),
+                sep="_"
+                )
         
         return gdf_points
         
\ No newline at end of file
@@ -5,20 +5,67 @@ Created on Tue Mar 17 15:10:51 2020
 
 @author: thomleysens
 """
+import numpy as np
+import shapely
 import geopandas as gpd
 import fiona
 import time
 from shapely import speedups
-from shapely.geometry import Polygon, MultiPolygon
-import osmnx as ox
 import os
 import re
-from copy import deepcopy
+import json
+import shutil
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 speedups.enable()
 
 from ..logger.logger import _get_duration, logger
+from .operations import get_intersect_pairs, repair_geometries
+from .operations import to_multipolygons
 
+#Per worker process state (set once by _init_worker)
+_WORKER = {}
+
+def _init_worker(geometries, intersections):
+    """
+    Description:
+    ------------
+    Initialize a worker process: build the STRtree of the source 
+    geometries once and keep the GetIntersections parameters
+
+    Parameters
+    ----------
+    geometries(array of Shapely geometries): source geometries
+    intersections(GetIntersections): object without source data
+
+    Returns
+    -------
+    None.
+
+    """
+    _WORKER["tree"] = shapely.STRtree(geometries)
+    _WORKER["intersections"] = intersections
+    
+def _get_layer_matches(intersecting_name):
+    """
+    Description:
+    ------------
+    Worker function: get the matches of one intersecting layer
+
+    Parameters
+    ----------
+    intersecting_name(str): name of the intersecting layer
+
+    Returns
+    -------
+    (classe, positions of matched source geometries)
+
+    """
+    return _WORKER["intersections"].get_layer_matches(
+        intersecting_name, 
+        _WORKER["tree"]
+        )
     
 class GetIntersections:
     """
@@ -26,10 +73,13 @@ class GetIntersections:
     ------------
     Get intersections of base (Multi-)Polygons layers with intersecting
     (Multi-)Polygons layers from GeoPackage files
-    Write feather files (very fast writing compared to GeoJSON writing or 
-    GPKG writing so useful for testing)
-    Once all done, read and convert feather files to GPKG (GeoPackages) if 
-    write_gpkg is set to True (also delete feather files and directory).
+    If checkpoint is True, matches of each intersecting layer are saved as 
+    a checkpoint (Numpy array of source positions) in "<output>_checkpoints" 
+    as soon as the layer is done: a rerun after a crash skips layers already 
+    done and assembles output from the checkpoints. A checkpoint is only 
+    reused if it was made with the same inputs (files paths, modification 
+    times and sizes, layer features count) and parameters. Checkpoints are 
+    deleted once output is written.
     
     Warnings: 
         - writing GPKG could be a very long process according to data size
@@ -48,11 +98,33 @@ class GetIntersections:
         EPSG for outputs 
         The default is "2154".
     quadrat_width(real) :
-        Width for grid (for intersection computing)
+        Width of the grid cells intersecting geometries are cut with (for 
+        intersection computing)
         The default is 500.
     driver(str) :
         Driver for writing: "FEATHER", "GEOJSON" or "GPKG"
         Default: "GPKG"
+    bitpacked(bool) :
+        Also write all the classes as one integer column ("classes") with 
+        one bit per class (bit i for the i-th layer, 63 layers max)
+        Default: False
+    workers(int) :
+        Number of processes for intersecting layers (processed in 
+        parallel if > 1)
+        Default: 1
+    chunksize(int) :
+        If set, stream the source layers by chunks of chunksize features 
+        against an index of all the intersecting layers and append results 
+        to output chunk by chunk (bounded memory, serial)
+        Default: None
+    checkpoint(bool) :
+        Save and reuse per layer checkpoints (not in chunked mode)
+        Default: False
+    coverage(bool) :
+        Also compute the ratio of each source geometry area covered by each 
+        intersecting layer (one float column "coverage_<classe>" per class,
+        overlapping features of a layer are counted once)
+        Default: False
 
     Returns
     -------
@@ -66,7 +138,12 @@ class GetIntersections:
             output,
             epsg=2154,
             quadrat_width = 500,
-            driver = "GPKG"
+            driver = "GPKG",
+            bitpacked = False,
+            workers = 1,
+            chunksize = None,
+            checkpoint = False,
+            coverage = False
             ):
         
         self.source_gpkg = source_gpkg
@@ -75,91 +152,341 @@ class GetIntersections:
         self.epsg = epsg
         self.quadrat_width = quadrat_width
         self.driver = driver
+        self.bitpacked = bitpacked
+        self.workers = workers
+        self.chunksize = chunksize
+        self.checkpoint = checkpoint
+        self.checkpoint_dir = os.path.splitext(self.output)[0] + "_checkpoints"
+        self.coverage = coverage
+        #Layers (or files) already written (later writes are appended)
+        self.written = set()
         
-        self.classes = {
+        #Classes in layers order (one column of the membership matrix each)
+        self.classes = [
             int(
                 re.search(r'\d+', name
                           ).group()
-                ):False for name in fiona.listlayers(self.intersecting_gpkg)
+                ) for name in fiona.listlayers(self.intersecting_gpkg)
+            ]
+        self.classes_pos = {
+            classe:i for i, classe in enumerate(self.classes)
             }
         
-        self.get_all_intersected()
+        if self.chunksize is None:
+            self.get_all_intersected()
+        else:
+            self.get_all_intersected_chunked()
 
             
-    def get_intersect_matches(self, possible_intersected, intersecting):
+    def __getstate__(self):
+        #Source data is shared with workers separately (see _init_worker)
+        state = self.__dict__.copy()
+        for key in ["source_gdf", "membership", "coverages"]:
+            state.pop(key, None)
+            
+        return state
+            
+    def checkpoint_path(self, intersecting_name):
         """
         Description:
         ------------
+        Path of the checkpoint of an intersecting layer
+    
+        Parameters
+        ----------
+        intersecting_name(str): name of the intersecting layer
+    
+        Returns
+        -------
+        str
+    
+        """
+        return os.path.join(
+            self.checkpoint_dir, 
+            "{}.npz".format(intersecting_name)
+            )
         
-        Get the geometries (possible_intersected) that intersect with the 
-        base geometry (base)
-        
-        Parameters:
-        -----------
-        
-        - base(Shapely Polygon)
-        - possible_intersected(GeoDataFrame)
+    def checkpoint_fingerprint(self, intersecting_name):
         """
+        Description:
+        ------------
+        Fingerprint of the inputs and parameters of an intersecting layer 
+        result (a checkpoint with another fingerprint is outdated)
+    
+        Parameters
+        ----------
+        intersecting_name(str): name of the intersecting layer
+    
+        Returns
+        -------
+        str (JSON)
+    
+        """
+        files = {}
+        for key, path in [
+                ("source", self.source_gpkg), 
+                ("intersecting", self.intersecting_gpkg)
+                ]:
+            stat = os.stat(path)
+            files[key] = [os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+        with fiona.open(self.intersecting_gpkg, layer=intersecting_name) as layer:
+            n_features = len(layer)
+            
+        return json.dumps(
+            {
+                "files":files,
+                "layer":intersecting_name,
+                "n_features":n_features,
+                "n_sources":len(self.source_gdf),
+                "epsg":self.epsg,
+                "quadrat_width":self.quadrat_width,
+                "coverage":self.coverage
+                },
+            sort_keys=True
+            )
         
-        matches = []
-        sindex = possible_intersected.sindex
+    def load_checkpoint(self, intersecting_name):
+        """
+        Description:
+        ------------
+        Load the matches of an intersecting layer from its checkpoint
+    
+        Parameters
+        ----------
+        intersecting_name(str): name of the intersecting layer
+    
+        Returns
+        -------
+        (positions of matched source geometries, their coverage ratios or 
+        None) or None if no checkpoint (or outdated, see 
+        checkpoint_fingerprint)
+    
+        """
+        path = self.checkpoint_path(intersecting_name)
+        if self.checkpoint is False or os.path.isfile(path) is False:
+            return None
         
-        for poly in intersecting:
-            possible_matches_index = list(sindex.intersection(poly.bounds))
-            possible_matches = possible_intersected.iloc[possible_matches_index]
-            precise_matches = possible_matches[
-                    possible_matches.intersects(poly)
-                    ]
-            matches.extend(precise_matches.index)
+        with np.load(path) as checkpoint:
+            fingerprint = self.checkpoint_fingerprint(intersecting_name)
+            if (
+                    "fingerprint" not in checkpoint
+                    or str(checkpoint["fingerprint"]) != fingerprint
+                    ):
+                logger.warning(
+                    """
+                    Outdated checkpoint (ignored): {}
+                    """.format(
+                    path
+                    )
+                )
+                return None
             
-        matches = list(set(matches))
+            if self.coverage is True:
+                return checkpoint["matches"], checkpoint["coverage"]
+            else:
+                return checkpoint["matches"], None
+    
+    def save_checkpoint(self, intersecting_name, matches, ratios=None):
+        """
+        Description:
+        ------------
+        Save the matches of an intersecting layer as a checkpoint
+    
+        Parameters
+        ----------
+        intersecting_name(str): name of the intersecting layer
+        matches(Numpy array): positions of matched source geometries
+        ratios(Numpy array): coverage ratios of matched source geometries
+    
+        Returns
+        -------
+        None.
+    
+        """
+        if self.checkpoint is False:
+            return
         
-        return matches
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = self.checkpoint_path(intersecting_name)
+        #Write then rename so that a crash never leaves a partial checkpoint
+        tmp_path = path + ".tmp.npz"
+        arrays = {
+            "matches":matches.astype(np.min_scalar_type(len(self.source_gdf))),
+            "fingerprint":self.checkpoint_fingerprint(intersecting_name)
+            }
+        if ratios is not None:
+            arrays["coverage"] = ratios
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+    
+    def read_intersecting(self, intersecting_name):
+        """
+        Description:
+        ------------
+        Read, repare, reproject and prepare an intersecting layer. If 
+        coverage is True, the layer is merged (one union) before being cut 
+        so its pieces do not overlap (see get_coverages)
+    
+        Parameters
+        ----------
+        intersecting_name(str): name of the intersecting layer
+    
+        Returns
+        -------
+        Numpy array of Shapely Polygons
+    
+        """
+        intersecting_gdf = gpd.read_file(
+            self.intersecting_gpkg, 
+            layer=intersecting_name
+            )
+        intersecting_gdf = repair_geometries(intersecting_gdf)
+        #Empty (or still invalid) geometries are not intersected
+        intersecting_gdf = intersecting_gdf.loc[
+            intersecting_gdf["validity"]==True
+            ].to_crs(epsg=self.epsg)
+        if self.coverage is True:
+            intersecting_gdf = gpd.GeoDataFrame(
+                geometry=[shapely.union_all(intersecting_gdf.geometry.values)],
+                crs=intersecting_gdf.crs
+                )
         
-    def buffer_repare(self, polygon):
+        return shapely.get_parts(self.prepare_geom(intersecting_gdf))
+    
+    def get_intersect_matches(self, possible_intersected, intersecting):
         """
         Description:
         ------------
-        Buffer a (Multi-)Polygon
+        Get the geometries (possible_intersected) that intersect with the 
+        intersecting geometries (bulk query, see get_intersect_pairs)
     
         Parameters
         ----------
-        polygon(Shapely Polygon): Polygon or Multi-Polygon
+        possible_intersected(GeoDataFrame): geometries to match
+        intersecting(array of Shapely geometries): intersecting geometries
     
         Returns
         -------
-        (Multi-)Polygon with 0.0 buffer
+        List of index labels of matched geometries (possible_intersected)
     
         """
-        return polygon.buffer(0.0)
+        _, intersected_pos = get_intersect_pairs(
+            np.asarray(intersecting), 
+            np.asarray(possible_intersected.geometry.values)
+            )
         
-    def repare_geom(self, gdf):
+        return possible_intersected.index[
+            np.unique(intersected_pos)
+            ].to_list()
+    
+    def get_layer_matches(self, intersecting_name, tree):
         """
         Description:
         ------------
-        Try to repare invalid geometry with a 0.0 buffering
+        Read, repare, reproject and prepare an intersecting layer then get 
+        the source geometries (indexed in tree) that intersect with it
     
         Parameters
         ----------
-        gdf(GeoDataFrame): GeoPandas GeoDataFrame with (Multi-)Polygons
+        intersecting_name(str): name of the intersecting layer
+        tree(Shapely STRtree): tree of the source geometries
     
         Returns
         -------
-        GeoDataFrame with fixed geometries
+        (classe, Numpy array of positions of matched source geometries, 
+        Numpy array of their coverage ratios or None)
     
         """
-        gdf["validity"] = gdf["geometry"].is_valid
-        gdf.loc[gdf["validity"] == False]["geometry"].map(self.buffer_repare)
-        #Check if still invalid geometries
-        gdf["validity"] = gdf["geometry"].is_valid
+        start = time.time()
+        intersecting = self.read_intersecting(intersecting_name)
+        
+        intersecting_pos, sources_pos = get_intersect_pairs(
+            intersecting, 
+            tree
+            )
+        matches = np.unique(sources_pos)
+        ratios = None
+        if self.coverage is True:
+            ratios = self.get_coverages(
+                tree.geometries, 
+                sources_pos, 
+                intersecting, 
+                intersecting_pos
+                )[matches, 0]
+        
+        classe = int(re.search(r'\d+', intersecting_name).group())
         
-        return gdf
+        logger.warning(
+            """
+            Intersecting layer:         {}
+            Intersection process:       {}  
+            """.format(
+            intersecting_name, 
+            _get_duration(start)
+            )
+        )
+        
+        return classe, matches, ratios
     
+    def get_coverages(
+            self, 
+            sources, 
+            sources_pos, 
+            intersecting, 
+            intersecting_pos, 
+            columns=0, 
+            n_columns=1
+            ):
+        """
+        Description:
+        ------------
+        Get the ratios of sources areas covered by intersecting geometries 
+        from intersecting pairs: intersection areas of all the pairs are 
+        summed by source and column. Intersecting geometries of a column 
+        must not overlap (pieces of a merged layer, see read_intersecting) 
+        so they are counted once.
+    
+        Parameters
+        ----------
+        sources(array of Shapely geometries): source geometries
+        sources_pos(Numpy array): positions in sources of pairs
+        intersecting(array of Shapely geometries): intersecting geometries
+        intersecting_pos(Numpy array): positions in intersecting of pairs
+        columns(int or Numpy array): column of each pair
+        n_columns(int): number of columns
+    
+        Returns
+        -------
+        Numpy array (len(sources) x n_columns)
+    
+        """
+        coverages = np.zeros((len(sources), n_columns))
+        np.add.at(
+            coverages, 
+            (sources_pos, columns), 
+            shapely.area(
+                shapely.intersection(
+                    sources[sources_pos], 
+                    intersecting[intersecting_pos]
+                    )
+                )
+            )
+        sources_areas = shapely.area(sources)[:, None]
+        np.divide(
+            coverages, 
+            sources_areas, 
+            out=coverages, 
+            where=sources_areas > 0
+            )
+        
+        return np.clip(coverages, 0.0, 1.0)
+        
     def prepare_geom(self, gdf):
         """
         Description:
         ------------
-        Quadrat cut the geometry (iloc[0] of the GeoDataFrame
+        Cut all the geometries of the GeoDataFrame with a grid of 
+        quadrat_width cells (geometries within a single cell are kept whole)
 
         Parameters
         ----------
@@ -167,19 +494,184 @@ class GetIntersections:
 
         Returns
         -------
-        Osmnx quadrat cut geometry
+        Numpy array of Shapely geometries
 
         """
-        # make the geometry a multipolygon if it's not already
-        geometry = gdf["geometry"].iloc[0]
-        if isinstance(geometry, Polygon):
-            geometry = MultiPolygon([geometry])
+        geometries = shapely.get_parts(gdf["geometry"].values)
+        geometries = geometries[~shapely.is_empty(geometries)]
+        
+        #Range of grid cells covered by each geometry bounds
+        bounds = shapely.bounds(geometries)
+        cells_min = np.floor(bounds[:, :2] / self.quadrat_width).astype(int)
+        cells_max = np.floor(bounds[:, 2:] / self.quadrat_width).astype(int)
+        cells_shape = cells_max - cells_min + 1
+        n_cells = cells_shape[:, 0] * cells_shape[:, 1]
+        
+        #One (geometry, cell) pair per cell of each multi-cells geometry
+        multi = np.flatnonzero(n_cells > 1)
+        geometries_pos = np.repeat(multi, n_cells[multi])
+        cells_rank = np.arange(len(geometries_pos)) - np.repeat(
+            np.cumsum(n_cells[multi]) - n_cells[multi], 
+            n_cells[multi]
+            )
+        cells_x = (
+            cells_min[geometries_pos, 0] 
+            + cells_rank % cells_shape[geometries_pos, 0]
+            ) 
+        cells_y = (
+            cells_min[geometries_pos, 1] 
+            + cells_rank // cells_shape[geometries_pos, 0]
+            )
+        cells = shapely.box(
+            cells_x * self.quadrat_width,
+            cells_y * self.quadrat_width,
+            (cells_x + 1) * self.quadrat_width,
+            (cells_y + 1) * self.quadrat_width
+            )
+        
+        pieces = shapely.intersection(geometries[geometries_pos], cells)
+        pieces = pieces[~shapely.is_empty(pieces)]
             
-        return ox.quadrat_cut_geometry(
-            geometry,
-            quadrat_width = self.quadrat_width
-            )  
+        return np.concatenate([geometries[n_cells == 1], pieces])
+    
+    def add_classes_columns(self, gdf, membership, coverages=None):
+        """
+        Description:
+        ------------
+        Write a membership matrix to gdf as one boolean column per class 
+        ("class_<classe>") and, if bitpacked, as one integer column 
+        ("classes"), and coverage ratios as one float column per class 
+        ("coverage_<classe>")
+    
+        Parameters
+        ----------
+        gdf(GeoDataFrame): source (Multi-)Polygons
+        membership(Numpy array): boolean matrix (len(gdf) x n_classes)
+        coverages(Numpy array): float matrix (len(gdf) x n_classes)
+    
+        Returns
+        -------
+        None.
+    
+        """
+        for classe, i in self.classes_pos.items():
+            gdf["class_{}".format(classe)] = membership[:, i]
+            if coverages is not None:
+                gdf["coverage_{}".format(classe)] = coverages[:, i]
+        
+        if self.bitpacked is True:
+            if len(self.classes) > 63:
+                logger.warning(
+                    """
+                    Too many classes for bitpacking: {}
+                    """.format(
+                    len(self.classes)
+                    )
+                )
+            else:
+                bits = np.left_shift(
+                    np.int64(1), 
+                    np.arange(len(self.classes), dtype=np.int64)
+                    )
+                gdf["classes"] = (
+                    membership.astype(np.int64) * bits
+                    ).sum(axis=1)
    
+    def update_classes(self, results):
+        """
+        Description:
+        ------------
+        Update the membership matrix with layers results as they come 
+        (in any order) and save their checkpoints
+    
+        Parameters
+        ----------
+        results(iterable): (intersecting_name, (classe, matches, ratios)) 
+        for each layer
+    
+        Returns
+        -------
+        None.
+    
+        """
+        for intersecting_name, (classe, matches, ratios) in results:
+            self.membership[matches, self.classes_pos[classe]] = True
+            if ratios is not None:
+                self.coverages[matches, self.classes_pos[classe]] = ratios
+            self.save_checkpoint(intersecting_name, matches, ratios)
+    
+    def clean_source(self, gdf):
+        """
+        Description:
+        ------------
+        Repare and reproject source (Multi-)Polygons, Polygons are promoted 
+        to MultiPolygons (single geometry type in outputs)
+    
+        Parameters
+        ----------
+        gdf(GeoDataFrame): source (Multi-)Polygons
+    
+        Returns
+        -------
+        (GeoDataFrame of valid geometries, GeoDataFrame of invalid ones)
+    
+        """
+        gdf = repair_geometries(gdf)
+        gdf = gdf.to_crs(epsg=self.epsg)
+        gdf[gdf.geometry.name] = gpd.GeoSeries(
+            to_multipolygons(gdf.geometry.values), 
+            index=gdf.index, 
+            crs=gdf.crs
+            )
+        
+        return (
+            gdf.loc[gdf["validity"]==True], 
+            gdf.loc[gdf["validity"]==False]
+            )
+    
+    def write_output(self, gdf, invalid):
+        """
+        Description:
+        ------------
+        Write classified and invalid (Multi-)Polygons (appended if already 
+        written)
+    
+        Parameters
+        ----------
+        gdf(GeoDataFrame): classified (Multi-)Polygons
+        invalid(GeoDataFrame): invalid (Multi-)Polygons
+    
+        Returns
+        -------
+        None.
+    
+        """
+        if self.driver == "GPKG":
+            outputs = [
+                (gdf, self.output, "classified"), 
+                (invalid, self.output, "invalid")
+                ]
+        elif self.driver == "GEOJSON":
+            invalid_name = os.path.splitext(self.output)[0]
+            invalid_name = invalid_name + "_invalid_.geojson"
+            outputs = [
+                (gdf, self.output, None), 
+                (invalid, invalid_name, None)
+                ]
+        else:
+            outputs = []
+            
+        for data, path, layer in outputs:
+            if data.empty is True:
+                continue
+            kwargs = {"driver":"GeoJSON"}
+            if layer is not None:
+                kwargs = {"driver":"GPKG", "layer":layer}
+            if (path, layer) in self.written:
+                kwargs["mode"] = "a"
+            data.to_file(path, **kwargs)
+            self.written.add((path, layer))
+    
     def get_all_intersected(self):
         """
         Description:
@@ -204,18 +696,20 @@ class GetIntersections:
                 )
             sources.append(source_gdf)
         
-        self.source_gdf = gpd.pd.concat(sources)
-        self.source_gdf = self.repare_geom(self.source_gdf)
-        self.source_gdf = self.source_gdf.to_crs(epsg=self.epsg)
-        self.source_gdf = self.source_gdf.loc[
-            self.source_gdf["validity"]==True
-            ]
+        self.source_gdf, invalid = self.clean_source(
+            gpd.pd.concat(sources)
+            )
         self.source_gdf.reset_index(inplace=True)
         
-        self.source_gdf["classes"] = [
-            deepcopy(self.classes) for i in range(len(self.source_gdf))
-            ]
-        invalid = self.source_gdf.loc[self.source_gdf["validity"]==False]
+        #Membership matrix (n_sources x n_classes)
+        self.membership = np.zeros(
+            (len(self.source_gdf), len(self.classes)), 
+            dtype=bool
+            )
+        #Coverage ratios matrix (n_sources x n_classes)
+        self.coverages = None
+        if self.coverage is True:
+            self.coverages = np.zeros(self.membership.shape)
         
         logger.warning(
                 """
@@ -225,56 +719,213 @@ class GetIntersections:
                 )
             )
         
+        #Layers already done (from checkpoints)
+        intersecting_names = []
         for intersecting_name in fiona.listlayers(self.intersecting_gpkg):
-            start = time.time()
-            intersecting_gdf = gpd.read_file(
-                self.intersecting_gpkg, 
-                layer=intersecting_name
+            checkpoint = self.load_checkpoint(intersecting_name)
+            if checkpoint is None:
+                intersecting_names.append(intersecting_name)
+            else:
+                classe = int(re.search(r'\d+', intersecting_name).group())
+                matches, ratios = checkpoint
+                self.membership[matches, self.classes_pos[classe]] = True
+                if ratios is not None:
+                    self.coverages[matches, self.classes_pos[classe]] = ratios
+                logger.warning(
+                    """
+                    Intersecting layer:         {}
+                    Loaded from checkpoint
+                    """.format(
+                    intersecting_name
+                    )
                 )
-            intersecting_gdf = self.repare_geom(intersecting_gdf)
-            intersecting_gdf = intersecting_gdf.to_crs(epsg=self.epsg)
-            intersecting = self.prepare_geom(intersecting_gdf)
-            
-            matches = self.get_intersect_matches(self.source_gdf, intersecting)
-            matches = list(set(matches))
-            classe = int(re.search(r'\d+', intersecting_name).group())
-
-            #Update classes
-            for match in matches:
-                self.source_gdf.at[match, "classes"].update({classe:True})
-            
-            logger.warning(
+                
+        geometries = self.source_gdf["geometry"].values
+        
+        if self.workers > 1 and len(intersecting_names) > 0:
+            with ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_worker,
+                    initargs=(np.asarray(geometries), self)
+                    ) as executor:
+                #Layers are updated (and checkpointed) as soon as they are 
+                ## done, whatever their submission order
+                futures = {}
+                for intersecting_name in intersecting_names:
+                    future = executor.submit(
+                        _get_layer_matches, 
+                        intersecting_name
+                        )
+                    futures[future] = intersecting_name
+                self.update_classes(
+                    (futures[future], future.result()) 
+                    for future in as_completed(futures)
+                    )
+        else:
+            tree = shapely.STRtree(np.asarray(geometries))
+            self.update_classes(
+                (
+                    intersecting_name, 
+                    self.get_layer_matches(intersecting_name, tree)
+                    ) 
+                for intersecting_name in intersecting_names
+                )
+        
+        start = time.time()
+        
+        self.add_classes_columns(
+            self.source_gdf, 
+            self.membership, 
+            self.coverages
+            )
+        self.write_output(self.source_gdf, invalid)
+        #Output written: checkpoints are not needed anymore
+        if self.checkpoint is True:
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        
+        logger.warning(
                 """
-                Intersecting layer:         {}
-                Intersection process:       {}  
+                Writing process:       {}  
                 """.format(
-                intersecting_name, 
                 _get_duration(start)
                 )
             )
+    
+    def check_source_schemas(self):
+        """
+        Description:
+        ------------
+        Check that all source layers have the same attributes (names and 
+        types): in chunked mode, they are all appended to the same output 
+        layer
+    
+        Returns
+        -------
+        List of source layers names
+    
+        """
+        source_names = fiona.listlayers(self.source_gpkg)
+        schemas = {}
+        for source_name in source_names:
+            with fiona.open(self.source_gpkg, layer=source_name) as layer:
+                schemas[source_name] = dict(layer.schema["properties"])
         
+        reference = schemas[source_names[0]]
+        different = [
+            source_name for source_name in source_names 
+            if schemas[source_name] != reference
+            ]
+        if len(different) > 0:
+            raise ValueError(
+                """
+                Source layers {} do not have the same attributes as {} 
+                ({}): they can not be appended to the same output layer 
+                (chunked mode)
+                """.format(
+                different, 
+                source_names[0],
+                reference
+                )
+            )
+        
+        return source_names
+    
+    def get_all_intersected_chunked(self):
+        """
+        Description:
+        ------------
+        Get all intersecting (Multi-) Polygons by chunks of source features:
+        index all intersecting layers once, then read (one sequential 
+        cursor per layer), classify and write source layers chunk by chunk 
+        (memory bounded by chunksize). Source layers must have the same 
+        attributes.
+    
+        Returns
+        -------
+        None.
+    
+        """    
         start = time.time()
+        source_names = self.check_source_schemas()
         
-        if self.driver == "GPKG":
-            self.source_gdf.to_file(
-                self.output, 
-                layer = "classified", 
-                driver="GPKG"
+        #Index of all intersecting layers (column of each geometry class)
+        intersecting = []
+        intersecting_col = []
+        for intersecting_name in fiona.listlayers(self.intersecting_gpkg):
+            geometries = self.read_intersecting(intersecting_name)
+            classe = int(re.search(r'\d+', intersecting_name).group())
+            intersecting.append(geometries)
+            intersecting_col.append(
+                np.full(len(geometries), self.classes_pos[classe])
                 )
-            if invalid.empty is False:
-                invalid.to_file(self.output, layer = "invalid", driver="GPKG")
-
-        elif self.driver == "GEOJSON":
-            self.source_gdf.to_file(self.output, driver="GeoJSON")
-            if invalid.empty is False:
-                invalid_name = os.path.splitext(self.output)[0]
-                invalid_name = invalid_name + "_invalid_.geojson"
-                invalid.to_file(invalid_name, driver="GeoJSON")
+        tree = shapely.STRtree(np.concatenate(intersecting))
+        intersecting_col = np.concatenate(intersecting_col)
         
         logger.warning(
                 """
-                Writing process:       {}  
+                Intersecting layers index:         {}
                 """.format(
                 _get_duration(start)
                 )
-            )
\ No newline at end of file
+            )
+        
+        for source_name in source_names:
+            start = time.time()
+            offset = 0
+            
+            with fiona.open(self.source_gpkg, layer=source_name) as layer:
+                crs = layer.crs_wkt
+                columns = list(layer.schema["properties"]) + ["geometry"]
+                features = iter(layer)
+                while True:
+                    chunk = list(islice(features, self.chunksize))
+                    if len(chunk) == 0:
+                        break
+                    source_gdf = gpd.GeoDataFrame.from_features(
+                        chunk, 
+                        crs=crs, 
+                        columns=columns
+                        )
+                    source_gdf.index = source_gdf.index + offset
+                    offset += len(source_gdf)
+                    
+                    source_gdf, invalid = self.clean_source(source_gdf)
+                    source_gdf.reset_index(inplace=True)
+                    
+                    source_pos, intersecting_pos = get_intersect_pairs(
+                        source_gdf["geometry"].values, 
+                        tree
+                        )
+                    membership = np.zeros(
+                        (len(source_gdf), len(self.classes)), 
+                        dtype=bool
+                        )
+                    membership[
+                        source_pos, 
+                        intersecting_col[intersecting_pos]
+                        ] = True
+                    coverages = None
+                    if self.coverage is True:
+                        coverages = self.get_coverages(
+                            np.asarray(source_gdf["geometry"].values), 
+                            source_pos, 
+                            tree.geometries, 
+                            intersecting_pos, 
+                            intersecting_col[intersecting_pos], 
+                            len(self.classes)
+                            )
+                    
+                    self.add_classes_columns(source_gdf, membership, coverages)
+                    self.write_output(source_gdf, invalid)
+            
+            logger.warning(
+                """
+                Source layer:               {}
+                Features:                   {}
+                Intersection process:       {}  
+                """.format(
+                source_name, 
+                offset,
+                _get_duration(start)
+                )
+            )
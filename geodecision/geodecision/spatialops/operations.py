@@ -6,6 +6,8 @@ Created on Fri Sep 20 09:24:58 2019
 @author: thomas
 """
 import time
+import numpy as np
+import shapely
 from shapely.ops import unary_union
 from shapely import speedups
 import geopandas as gpd
@@ -41,6 +43,166 @@ def gdf_to_geosource(gdf):
             )
         )
 
+def _polygonal_parts(geometries):
+    """
+    Description
+    ------------
+    
+    Keep only the polygonal parts of geometries (e.g. GeometryCollections 
+    from make_valid)
+    
+    Returns
+    --------
+    
+    Numpy array of Shapely MultiPolygons
+    
+    Parameters
+    -----------
+    
+    - geometries (array of Shapely geometries)
+    """
+    parts, parts_idx = shapely.get_parts(geometries, return_index=True)
+    parts, sub_idx = shapely.get_parts(parts, return_index=True)
+    parts_idx = parts_idx[sub_idx]
+    polygons = shapely.get_type_id(parts) == 3
+    
+    out = np.array([shapely.MultiPolygon()] * len(geometries), dtype=object)
+    if polygons.any():
+        shapely.multipolygons(
+                parts[polygons], 
+                indices=parts_idx[polygons],
+                out=out
+                )
+    
+    return out
+
+def to_multipolygons(geometries):
+    """
+    Description
+    ------------
+    
+    Promote Polygons to MultiPolygons (other geometries are unchanged), 
+    e.g. to get a single geometry type in outputs
+    
+    Returns
+    --------
+    
+    Numpy array of Shapely geometries
+    
+    Parameters
+    -----------
+    
+    - geometries (array of Shapely geometries)
+    """
+    geometries = np.array(geometries, dtype=object)
+    polygons = shapely.get_type_id(geometries) == 3
+    if polygons.any():
+        geometries[polygons] = shapely.multipolygons(
+                geometries[polygons][:, None]
+                )
+    
+    return geometries
+
+def repair_geometries(gdf, method="make_valid"):
+    """
+    Description
+    ------------
+    
+    Repair invalid geometries of a GeoDataFrame on whole arrays (validity 
+    is checked once, only invalid geometries are repaired) and add a 
+    "validity" column (validity after repair, empty geometries, e.g. 
+    repaired geometries without polygonal parts, are not valid). Counts 
+    are logged.
+    
+    Returns
+    --------
+    
+    GeoDataFrame (copy)
+    
+    Parameters
+    -----------
+    
+    - gdf(GeoDataFrame):
+        - GeoPandas GeoDataFrame
+    - method(str):
+        - "make_valid" (polygonal parts only kept for polygonal 
+        geometries) or "buffer" (0.0 buffer)
+        - default: "make_valid"
+    """
+    gdf = gdf.copy()
+    geometries = np.asarray(gdf.geometry.values)
+    invalid = np.flatnonzero(~shapely.is_valid(geometries))
+    
+    if len(invalid) > 0:
+        to_repair = geometries[invalid]
+        if method == "buffer":
+            repaired = shapely.buffer(to_repair, 0.0)
+        else:
+            repaired = shapely.make_valid(to_repair)
+            #Polygons must stay polygonal (empty if no polygonal part)
+            polygonal = np.isin(shapely.get_type_id(to_repair), [3, 6])
+            others = polygonal & ~np.isin(shapely.get_type_id(repaired), [3, 6])
+            repaired[others] = _polygonal_parts(repaired[others])
+        geometries = geometries.copy()
+        geometries[invalid] = repaired
+        gdf[gdf.geometry.name] = gpd.GeoSeries(
+                geometries, 
+                index=gdf.index, 
+                crs=gdf.crs
+                )
+    
+    empty = shapely.is_empty(geometries)
+    gdf["validity"] = shapely.is_valid(geometries) & ~empty
+    
+    logger.info(
+            """
+            Repair geometries ({}):
+                Invalid:            {}
+                Empty:              {}
+                Still invalid:      {}
+            """.format(
+                method,
+                len(invalid),
+                int(empty.sum()),
+                int((~gdf["validity"]).sum())
+            )
+        )
+    
+    return gdf
+
+def get_intersect_pairs(base, possible_intersected):
+    """
+    Description:
+    ------------
+    
+    Get all the pairs of intersecting geometries between base and 
+    possible_intersected with a single bulk query on a STRtree of 
+    possible_intersected (base geometries are prepared by the query itself 
+    and are not modified)
+    
+    Returns:
+    --------
+    
+    - base_pos (Numpy array): positions in base
+    - intersected_pos (Numpy array): positions in possible_intersected
+    
+    Parameters:
+    -----------
+    
+    - base (array of Shapely geometries)
+    - possible_intersected (array of Shapely geometries or STRtree)
+    """
+    if isinstance(possible_intersected, shapely.STRtree):
+        tree = possible_intersected
+    else:
+        tree = shapely.STRtree(np.asarray(possible_intersected))
+    base_pos, intersected_pos = tree.query(
+            np.asarray(base), 
+            predicate="intersects"
+            )
+    
+    return base_pos, intersected_pos
+
 def get_intersect_matches(base, possible_intersected):
         """
         Description:
@@ -56,19 +218,14 @@ def get_intersect_matches(base, possible_intersected):
         - possible_intersected(GeoDataFrame)
         """
         #TODO: Check if intersection on "to" is necessary
-        matches = []
-        possible_intersected = possible_intersected.set_geometry("from")
-        sindex = possible_intersected.sindex
-        
-        for poly in base:
-            possible_matches_index = list(sindex.intersection(poly.bounds))
-            possible_matches = possible_intersected.iloc[possible_matches_index]
-            precise_matches = possible_matches[
-                    possible_matches.intersects(poly)
-                    ]
-            matches.extend(precise_matches.index)
+        _, intersected_pos = get_intersect_pairs(
+                shapely.get_parts(base),
+                possible_intersected["from"].values
+                )
             
-        return list(set(matches))
+        return possible_intersected.index[
+                np.unique(intersected_pos)
+                ].to_list()
 
 class SpatialOperations:
     """
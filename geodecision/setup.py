@@ -20,10 +20,9 @@ setup(
     packages=find_packages(include=["geodecision", "geodecision.*"]),
     install_requires=[
 			"bokeh>=1.4",
-			"fiona"
-			"geopandas>=0.6.0",
+			"fiona",
+			"geopandas>=0.12",
 			"geojson>=2.4.1",
-			"geopy>=1.20.0",
 			"jsonschema>=3.2.0",
 			"mapclassify>=2.1.1",
 			"networkx>=2.3",
@@ -31,17 +30,17 @@ setup(
 			"osmnx>=0.10",
 			"pandas>=1.0.0",
 			"pyproj>=2.4.2.post1",
-			"rtree>=0.9.3",
-			"shapely>=1.6.4"
+			"shapely>=2.0"
 		     ],
     keywords="geodecision",
-    python_requires=">=3.6",
+    python_requires=">=3.8",
     classifiers=[
         "Development Status :: 2 - Pre-Alpha",
         "Intended Audience :: Developers",
         "Natural Language :: English",
-        "Programming Language :: Python :: 3.6",
-        "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
     ],
 )
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+"""Tests for `geodecision.citygml.analyseroofs`."""
+
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+import pytest
+
+from geodecision.citygml import analyseroofs
+from geodecision.citygml.analyseroofs import GetRoofsAndSlopes
+from geodecision.citygml.constants import GML_ID, TAGS, POSLISTS_BATCH
+
+
+HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<core:CityModel xmlns:core="http://www.opengis.net/citygml/2.0" '
+    'xmlns:gml="http://www.opengis.net/gml" '
+    'xmlns:bldg="http://www.opengis.net/citygml/building/2.0" '
+    'xmlns:gen="http://www.opengis.net/citygml/generics/2.0">\n'
+    )
+
+
+def surface(kind, surface_id, rings):
+    members = "".join(
+        '<gml:surfaceMember><gml:Polygon><gml:exterior><gml:LinearRing>'
+        '<gml:posList srsDimension="3">{}</gml:posList>'
+        '</gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember>'.format(
+            " ".join("{:.6f}".format(value) for value in np.ravel(ring))
+            )
+        for ring in rings
+        )
+    return (
+        '<bldg:boundedBy><bldg:{kind} gml:id="{id}"><bldg:lod2MultiSurface>'
+        '<gml:MultiSurface>{members}</gml:MultiSurface></bldg:lod2MultiSurface>'
+        '</bldg:{kind}></bldg:boundedBy>'
+        ).format(kind=kind, id=surface_id, members=members)
+
+
+def building(building_id, roofs, ground, name="maison", height=10.0, envelope=True):
+    """One Building: roofs is a list of RoofSurfaces (lists of rings)."""
+    content = ""
+    if envelope is True:
+        xyz = np.concatenate(
+            [np.reshape(ring, (-1, 3)) for rings in roofs + [[ground]] for ring in rings]
+            )
+        content += (
+            '<gml:boundedBy><gml:Envelope srsDimension="3">'
+            '<gml:lowerCorner>{} {} {}</gml:lowerCorner>'
+            '<gml:upperCorner>{} {} {}</gml:upperCorner>'
+            '</gml:Envelope></gml:boundedBy>'
+            ).format(*xyz.min(axis=0), *xyz.max(axis=0))
+    if name is not None:
+        content += (
+            '<gen:stringAttribute name="nom"><gen:value>{}</gen:value>'
+            '</gen:stringAttribute>'.format(name)
+            )
+    if height is not None:
+        content += '<bldg:measuredHeight uom="m">{}</bldg:measuredHeight>'.format(
+            height
+            )
+    for i, rings in enumerate(roofs):
+        content += surface("RoofSurface", "{}_R{}".format(building_id, i), rings)
+    content += surface("GroundSurface", "{}_G".format(building_id), [ground])
+
+    return (
+        '<core:cityObjectMember><bldg:Building gml:id="{}">{}'
+        '</bldg:Building></core:cityObjectMember>\n'.format(building_id, content)
+        )
+
+
+def write_city_gml(path, buildings):
+    with open(path, "w") as f:
+        f.write(HEADER + "".join(buildings) + "</core:CityModel>")
+
+
+def random_buildings(n, seed=0, x0=842000.0, y0=6519000.0):
+    """Buildings with several RoofSurfaces of several sloped strips each."""
+    rng = np.random.default_rng(seed)
+    buildings = []
+    for b in range(n):
+        x, y = rng.uniform(0, 2000, 2) + (x0, y0)
+        w, h = rng.uniform(5, 30, 2)
+        z = rng.uniform(150, 200)
+        ground = [[x, y, z], [x + w, y, z], [x + w, y + h, z], [x, y + h, z], [x, y, z]]
+        strips = np.linspace(x, x + w, 2 + b % 4)
+        rings = []
+        for xa, xb in zip(strips[:-1], strips[1:]):
+            rise = rng.uniform(-0.8, 0.8) * (xb - xa)
+            top = z + 10
+            rings.append([
+                [xa, y, top],
+                [xb, y, top + rise],
+                [xb, y + h, top + rise],
+                [xa, y + h, top],
+                [xa, y, top]
+                ])
+        # Degenerate posList (no polygon)
+        if b % 7 == 3:
+            rings.insert(0, [[x, y, z], [x + 1, y, z]])
+        roofs = [rings[:2], rings[2:]] if len(rings) > 2 else [rings]
+        buildings.append(
+            building(
+                "BU_{}".format(b),
+                roofs,
+                ground,
+                name=["maison", "école A", "mairie"][b % 3],
+                height=None if b % 5 == 4 else rng.uniform(3, 30),
+                envelope=b % 2 == 0
+                )
+            )
+
+    return buildings
+
+
+@pytest.fixture
+def city_gml(tmp_path):
+    path = str(tmp_path / "city.gml")
+    write_city_gml(path, random_buildings(40))
+
+    return path
+
+
+def reference_surfaces(path, kind):
+    """Previous DOM parsing: every posList of every surface of every Building."""
+    records = []
+    for elem in ET.parse(path).getroot().iter(TAGS["building"]):
+        for surface_elem in elem.iter(TAGS[kind]):
+            for element, posList in enumerate(surface_elem.iter(TAGS["poslist"])):
+                xyz = np.array(posList.text.split(), dtype=np.float64)
+                records.append(
+                    (
+                        elem.attrib[GML_ID],
+                        surface_elem.attrib[GML_ID],
+                        element,
+                        xyz.reshape(-1, 3)
+                        )
+                    )
+
+    return sorted(records, key=lambda record: record[1:3])
+
+
+def check_surfaces(gdf, expected):
+    gdf = gdf.sort_values(["ids", "elements"])
+    # Polygons only (posLists with less than 3 coordinates are dropped)
+    expected = [record for record in expected if len(record[3]) >= 3]
+
+    assert gdf["building_ids"].tolist() == [record[0] for record in expected]
+    assert gdf["ids"].tolist() == [record[1] for record in expected]
+    assert gdf["elements"].tolist() == [record[2] for record in expected]
+    np.testing.assert_allclose(
+        gdf.area.values,
+        shapely.area(shapely.polygons([record[3][:, :2] for record in expected]))
+        )
+    np.testing.assert_allclose(
+        shapely.get_coordinates(gdf.geometry.values),
+        np.concatenate([record[3][:, :2] for record in expected])
+        )
+
+
+@pytest.mark.parametrize("batch", [3, POSLISTS_BATCH])
+def test_streaming_parser_matches_dom(city_gml, monkeypatch, batch):
+    # posLists parsed by batches of 3 (several flushes) or all at once
+    monkeypatch.setattr(analyseroofs, "POSLISTS_BATCH", batch)
+    roofs = GetRoofsAndSlopes(city_gml, 2154, 2154, attributes=["nom"])
+
+    check_surfaces(roofs.gdf_roofs, reference_surfaces(city_gml, "roof"))
+    check_surfaces(roofs.gdf_grounds, reference_surfaces(city_gml, "ground"))
+    assert len(roofs.df_buildings) == 40
+
+
+def roof_ring(x, y, slope, clockwise=False, size=10.0, z=20.0):
+    """Square roof rising along x with the given slope (degrees)."""
+    rise = np.tan(np.radians(slope)) * size
+    ring = [
+        [x, y, z],
+        [x + size, y, z + rise],
+        [x + size, y + size, z + rise],
+        [x, y + size, z],
+        [x, y, z]
+        ]
+    if clockwise is True:
+        ring = ring[::-1]
+
+    return ring
+
+
+def square_building(building_id, roof, size=10.0):
+    x, y = roof[0][0], roof[0][1]
+    ground = [[x, y, 0], [x + size, y, 0], [x + size, y + size, 0], [x, y + size, 0], [x, y, 0]]
+
+    return building(building_id, [[roof]], ground)
+
+
+@pytest.mark.parametrize("clockwise", [False, True])
+def test_known_roof_slopes(tmp_path, clockwise):
+    slopes = [0.0, 15.0, 30.0, 45.0, 60.0]
+    path = str(tmp_path / "roofs.gml")
+    write_city_gml(
+        path,
+        [
+            square_building(
+                "BU_{}".format(i),
+                roof_ring(842000.0 + 100 * i, 6519000.0, slope, clockwise)
+                )
+            for i, slope in enumerate(slopes)
+            ]
+        )
+
+    roofs = GetRoofsAndSlopes(path, 2154, 2154, attributes=["nom"]).gdf_roofs
+    angles = roofs.set_index("ids")["angles"]
+
+    # Slopes do not depend on the orientation of the rings (0 to 90 degrees)
+    np.testing.assert_allclose(
+        angles.loc[["BU_{}_R0".format(i) for i in range(len(slopes))]].values,
+        slopes,
+        atol=1e-6
+        )
+
+
+def rotated_rectangle(x, y, width, length, angle, z=20.0):
+    """Flat rectangle (width x length) rotated by angle (degrees) around (x, y)."""
+    corners = np.array([[0, 0], [length, 0], [length, width], [0, width], [0, 0]])
+    theta = np.radians(angle)
+    rotation = np.array(
+        [[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]]
+        )
+    xy = corners @ rotation.T + (x, y)
+
+    return np.column_stack([xy, np.full(len(xy), z)]).tolist()
+
+
+@pytest.mark.parametrize("epsg_out", [2154, 4326])
+def test_min_widths(tmp_path, epsg_out):
+    widths = [4.0, 7.5, 9.992, 12.0]
+    angles = [0.0, 17.0, 45.0, 71.0]
+    path = str(tmp_path / "widths.gml")
+    write_city_gml(
+        path,
+        [
+            building(
+                "BU_{}".format(i),
+                [[rotated_rectangle(842000.0 + 100 * i, 6519000.0, width, 25.0, angle)]],
+                rotated_rectangle(842000.0 + 100 * i, 6519000.0, width, 25.0, angle, 0.0)
+                )
+            for i, (width, angle) in enumerate(zip(widths, angles))
+            ]
+        )
+
+    roofs = GetRoofsAndSlopes(path, 2154, epsg_out, attributes=["nom"])
+    gdf_roofs = roofs.gdf_roofs.set_index("ids")
+    min_widths = gdf_roofs["min_width"]
+
+    # Shortest side of the minimum rotated rectangle, to the millimetre
+    # (posLists are rounded), measured in UTM if epsg_out is geographic
+    np.testing.assert_allclose(
+        min_widths.loc[["BU_{}_R0".format(i) for i in range(len(widths))]].values,
+        widths,
+        atol=1e-3 if epsg_out == 2154 else 1e-2
+        )
+    assert gdf_roofs.crs.to_epsg() == epsg_out
+    assert roofs.gdf_grounds.crs.to_epsg() == epsg_out
+    assert "+init" not in roofs.gdf_roofs.crs.to_string()
+
+
+AOI = (842500.0, 6519500.0, 843500.0, 6520500.0)
+
+
+@pytest.mark.parametrize("epsg_out", [2154, 4326])
+def test_aoi(city_gml, epsg_out):
+    grounds = reference_surfaces(city_gml, "ground")
+    polygons = shapely.polygons([record[3][:, :2] for record in grounds])
+    box = shapely.box(*AOI)
+    # Buildings are far enough from the borders for a reprojected AOI
+    assert shapely.distance(polygons, box.boundary).min() > 1.0
+    expected = sorted(
+        record[0] for record, inside in zip(grounds, shapely.intersects(polygons, box))
+        if inside
+        )
+    assert 0 < len(expected) < 40
+
+    # AOI in epsg_out: bbox or reprojected Polygon
+    aoi = AOI
+    if epsg_out != 2154:
+        transformer = Transformer.from_crs(2154, epsg_out, always_xy=True)
+        aoi = shapely.transform(
+            shapely.segmentize(box, 10.0),
+            lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1]))
+            )
+    roofs = GetRoofsAndSlopes(city_gml, 2154, epsg_out, attributes=["nom"], aoi=aoi)
+
+    # Buildings with envelopes (tested on them) and without (first ground)
+    assert sorted(roofs.df_buildings.index) == expected
+    assert sorted(set(roofs.gdf_roofs["building_ids"])) == expected
+    assert sorted(roofs.gdf_grounds["building_ids"]) == expected
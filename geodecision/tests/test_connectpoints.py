@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+"""Tests for `geodecision.graph.connectpoints` and `geodecision.graph.nodeindex`."""
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import shapely.ops
+import pytest
+
+from geodecision.graph.connectpoints import ConnectPoints
+from geodecision.graph.nodeindex import NodeIndex
+
+
+def make_grid(n=6, spacing=50.0, n_points=200, seed=0):
+    """Small grid network (bent edges) and random points inside it."""
+    rng = np.random.default_rng(seed)
+    ids = np.arange(n * n).reshape(n, n)
+    xy = np.stack(np.meshgrid(np.arange(n), np.arange(n), indexing="ij"), -1)
+    xy = xy * spacing
+    nodes = gpd.GeoDataFrame(
+        {"osmid": ids.ravel().astype(str)},
+        geometry=shapely.points(xy.reshape(-1, 2))
+        )
+    sources, targets, lines = [], [], []
+    for i in range(n):
+        for j in range(n):
+            for di, dj in ((1, 0), (0, 1)):
+                if i + di < n and j + dj < n:
+                    a, b = xy[i, j], xy[i + di, j + dj]
+                    middle = (a + b) / 2 + rng.uniform(-5, 5, 2) * (dj, di)
+                    sources.append(str(ids[i, j]))
+                    targets.append(str(ids[i + di, j + dj]))
+                    lines.append(shapely.linestrings([a, middle, b]))
+    edges = gpd.GeoDataFrame(
+        {
+            "source": sources,
+            "target": targets,
+            "highway": "residential",
+            "oneway": False
+            },
+        geometry=lines
+        )
+    edges["length"] = edges.length
+    points = gpd.GeoDataFrame(
+        {"unique_id": ["p_{}".format(i) for i in range(n_points)]},
+        geometry=shapely.points(rng.uniform(0, spacing * (n - 1), (n_points, 2)))
+        )
+
+    return nodes, edges, points
+
+
+def make_connect_points(nodes, edges, points, **kwargs):
+    return ConnectPoints(
+        points.copy(),
+        nodes,
+        edges,
+        "park",
+        "test",
+        key_col="unique_id",
+        threshold=30,
+        **kwargs
+        )
+
+
+@pytest.fixture
+def grid():
+    return make_grid()
+
+
+def interpolate_split(line, cuts, tolerance):
+    """Split a line at linear references with shapely.ops.substring."""
+    cuts = np.unique(cuts[(cuts > tolerance) & (cuts < line.length - tolerance)])
+    bounds = np.concatenate([[0.0], cuts, [line.length]])
+    return [
+        shapely.ops.substring(line, start, end)
+        for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+
+
+def test_split_lines_preserves_lengths(grid):
+    nodes, edges, points = grid
+    cp = make_connect_points(nodes, edges, points)
+    cp.update_nodes_process()
+    segments_idx, segments = cp.split_lines(
+        cp.points["kne_idx"].values,
+        cp.points["pp_dist"].values,
+        cp.points["pp"].values
+        )
+    lengths = pd.Series(shapely.length(segments)).groupby(segments_idx).sum()
+
+    assert len(lengths) > 0
+    np.testing.assert_allclose(
+        lengths.values,
+        edges.length.loc[lengths.index].values
+        )
+
+
+def test_process_preserves_network_length(grid):
+    nodes, edges, points = grid
+    cp = make_connect_points(nodes, edges, points)
+    _, new_edges, _ = cp.process()
+    network = new_edges["highway"] != cp.edge_highway
+
+    assert new_edges.length[network].sum() == pytest.approx(edges.length.sum())
+
+
+def test_split_lines_matches_interpolate(grid):
+    nodes, edges, points = grid
+    cp = make_connect_points(nodes, edges, points)
+    cp.update_nodes_process()
+    kne_idx = cp.points["kne_idx"].values
+    pp_dist = cp.points["pp_dist"].values
+    segments_idx, segments = cp.split_lines(kne_idx, pp_dist, cp.points["pp"].values)
+
+    expected = []
+    for idx in np.unique(kne_idx):
+        expected.extend(
+            interpolate_split(
+                edges.geometry.loc[idx],
+                pp_dist[kne_idx == idx],
+                cp.tolerance
+                )
+            )
+
+    assert len(segments) == len(expected)
+    assert shapely.equals_exact(segments, np.array(expected), 1e-6).all()
+
+
+def test_no_unresolved_endpoints(grid):
+    nodes, edges, points = grid
+    cp = make_connect_points(nodes, edges, points)
+    new_nodes, new_edges, _ = cp.process()
+    osmids = set(new_nodes["osmid"])
+
+    assert (new_edges["source"] != "None").all()
+    assert (new_edges["target"] != "None").all()
+    assert set(new_edges["source"]) <= osmids
+    assert set(new_edges["target"]) <= osmids
+
+
+def test_node_index_resolves_all_endpoints(grid):
+    nodes, edges, _ = grid
+    index = NodeIndex(nodes)
+    geometries = edges.geometry.values
+
+    np.testing.assert_array_equal(
+        index.resolve(shapely.get_point(geometries, 0)),
+        edges["source"].values
+        )
+    np.testing.assert_array_equal(
+        index.resolve(shapely.get_point(geometries, -1)),
+        edges["target"].values
+        )
+    #Points within tolerance resolve to the same node, others are missing
+    shifted = shapely.points(shapely.get_coordinates(nodes.geometry.values) + 1e-7)
+    np.testing.assert_array_equal(index.resolve(shifted), nodes["osmid"].values)
+    assert (index.resolve(shapely.points([[1e6, 1e6]])) == "None").all()
+
+
+def sorted_edges(edges):
+    edges = edges[["source", "target", "highway", "geometry"]].astype(
+        {"source": str, "target": str}
+        )
+    return edges.sort_values(["source", "target"]).reset_index(drop=True)
+
+
+def test_connect_matches_process_on_union(grid):
+    nodes, edges, points = grid
+    union = make_connect_points(nodes, edges, points)
+    union_nodes, union_edges, _ = union.process()
+
+    incremental = make_connect_points(nodes, edges, points.iloc[:120])
+    incremental.process()
+    delta = incremental.connect(points.iloc[120:].copy())
+
+    assert len(delta.added_edges) > 0
+    assert set(incremental.nodes["osmid"]) == set(union_nodes["osmid"])
+    expected = sorted_edges(union_edges)
+    result = sorted_edges(incremental.edges)
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(expected.drop(columns="geometry")),
+        pd.DataFrame(result.drop(columns="geometry"))
+        )
+    assert shapely.equals_exact(
+        expected.geometry.values,
+        result.geometry.values,
+        1e-6
+        ).all()
+
+
+def test_save_load_round_trip(grid, tmp_path):
+    nodes, edges, points = grid
+    cp = make_connect_points(nodes, edges, points.iloc[:120])
+    cp.process()
+    path = str(tmp_path / "connect_points.pkl")
+    cp.save(path)
+    loaded = ConnectPoints.load(path)
+
+    pd.testing.assert_frame_equal(pd.DataFrame(loaded.edges), pd.DataFrame(cp.edges))
+    assert len(loaded.node_index) == len(cp.node_index)
+
+    new_points = points.iloc[120:]
+    expected = cp.connect(new_points.copy())
+    result = loaded.connect(new_points.copy())
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(result.added_edges),
+        pd.DataFrame(expected.added_edges)
+        )
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(result.added_nodes),
+        pd.DataFrame(expected.added_nodes)
+        )
+    np.testing.assert_array_equal(result.removed_edges, expected.removed_edges)
+
+
+def test_node_index_add_batches(grid):
+    nodes, _, _ = grid
+    index = NodeIndex(nodes)
+    xy = shapely.get_coordinates(nodes.geometry.values)
+
+    #First batch: one near-duplicate of a node, one new node
+    resolved = index.add(shapely.points([xy[0] + 1e-7, [1e4, 1e4]]), ["a", "b"])
+    np.testing.assert_array_equal(resolved, [nodes["osmid"].iloc[0], "b"])
+    assert len(index) == len(nodes) + 1
+
+    #Next batches resolve to nodes of the main tree and of added batches,
+    ## up to the merge of added nodes into the main tree
+    for i in range(len(nodes) + 1):
+        resolved = index.add(
+            shapely.points([[1e4, 1e4 + 1e-7], [2e4 + i, 0]]),
+            ["c{}".format(i), "d{}".format(i)]
+            )
+        np.testing.assert_array_equal(resolved, ["b", "d{}".format(i)])
+    assert index.added_tree is None or len(index) - index.n_indexed <= index.n_indexed
+    np.testing.assert_array_equal(
+        index.resolve(shapely.points([xy[1], [1e4, 1e4], [2e4, 1e-7]])),
+        [nodes["osmid"].iloc[1], "b", "d0"]
+        )
+
+
+def make_line(points_xy):
+    """One straight edge (0, 0) - (100, 0) and points."""
+    nodes = gpd.GeoDataFrame(
+        {"osmid": ["a", "b"]},
+        geometry=shapely.points([[0, 0], [100, 0]])
+        )
+    edges = gpd.GeoDataFrame(
+        {"source": ["a"], "target": ["b"], "highway": "residential", "oneway": False},
+        geometry=[shapely.linestrings([[0, 0], [100, 0]])]
+        )
+    edges["length"] = edges.length
+    points = gpd.GeoDataFrame(
+        {"unique_id": ["p_{}".format(i) for i in range(len(points_xy))]},
+        geometry=shapely.points(np.reshape(points_xy, (-1, 2)))
+        )
+
+    return nodes, edges, points
+
+
+def test_merge_points():
+    nodes, edges, points = make_line([[10, 5], [12, 4], [15, -6], [60, 5]])
+    cp = make_connect_points(nodes, edges, points, merge_distance=5)
+    new_nodes, new_edges, _ = cp.process()
+
+    #Chained points (10, 12, 15 along the edge) are merged into the one
+    ## closest to the edge
+    mapping = cp.merged_points.set_index("unique_id")["access_id"]
+    assert mapping.to_dict() == {"p_0": "p_1", "p_1": "p_1", "p_2": "p_1", "p_3": "p_3"}
+    access = new_nodes.loc[new_nodes["highway"] == cp.node_highway_access, "osmid"]
+    assert sorted(access) == ["p_1", "p_3"]
+    assert (new_edges["highway"] == cp.edge_highway).sum() == 2
+
+
+@pytest.mark.parametrize("points_xy", [np.empty((0, 2)), [[10, 500], [60, -500]]])
+def test_merge_points_without_points(points_xy):
+    nodes, edges, points = make_line(points_xy)
+    cp = make_connect_points(nodes, edges, points, merge_distance=5)
+    new_nodes, new_edges, _ = cp.process()
+
+    assert len(cp.merged_points) == 0
+    assert len(new_nodes) == len(nodes)
+    assert len(new_edges) == len(edges)
+
+
+def test_find_kne_partitioned_matches_find_kne(grid):
+    nodes, edges, points = grid
+    cp = make_connect_points(nodes, edges, points, workers=2, tile_size=60.0)
+    #Far points: tiles without edges (global fallback)
+    geometries = np.concatenate(
+        [
+            points.geometry.values,
+            shapely.points([[1e5, 1e5], [-1e5, 0]])
+            ]
+        )
+    kne_idx, kne_dist = cp.find_kne(geometries)
+    partitioned_idx, partitioned_dist = cp.find_kne_partitioned(geometries)
+
+    np.testing.assert_array_equal(partitioned_idx, kne_idx)
+    np.testing.assert_allclose(partitioned_dist, kne_dist)
+    assert cp.find_kne_partitioned(geometries[:0])[0].shape == (0,)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""Tests for `geodecision.spatialops.intersections`."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pytest
+
+from geodecision.spatialops.intersections import GetIntersections
+
+
+N_CLASSES = 3
+
+
+@pytest.fixture
+def gpkgs(tmp_path):
+    """Two source layers of boxes, intersecting layers of overlapping disks."""
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0, 2000, (400, 2))
+    boxes = shapely.box(*np.hstack([xy, xy + rng.uniform(5, 60, (400, 2))]).T)
+    source_gpkg = str(tmp_path / "sources.gpkg")
+    for i, layer in enumerate(np.array_split(np.arange(len(boxes)), 2)):
+        gpd.GeoDataFrame(
+            {"a": layer},
+            geometry=boxes[layer],
+            crs=2154
+            ).to_file(source_gpkg, layer="s{}".format(i), driver="GPKG")
+
+    intersecting_gpkg = str(tmp_path / "intersecting.gpkg")
+    layers = []
+    for classe in range(1, N_CLASSES + 1):
+        disks = shapely.buffer(
+            shapely.points(rng.uniform(0, 2000, (15, 2))),
+            rng.uniform(50, 300, 15)
+            )
+        layers.append(disks)
+        gpd.GeoDataFrame(
+            {"c": np.arange(len(disks))},
+            geometry=disks,
+            crs=2154
+            ).to_file(intersecting_gpkg, layer="zone_{}".format(classe), driver="GPKG")
+
+    return source_gpkg, intersecting_gpkg, boxes, layers
+
+
+def run(tmp_path, gpkgs, name, **kwargs):
+    source_gpkg, intersecting_gpkg = gpkgs[:2]
+    output = str(tmp_path / name)
+    GetIntersections(source_gpkg, intersecting_gpkg, output, **kwargs)
+    gdf = gpd.read_file(output, layer="classified")
+
+    return gdf.sort_values("a").reset_index(drop=True)
+
+
+def test_membership_matches_brute_force(tmp_path, gpkgs):
+    boxes, layers = gpkgs[2:]
+    gdf = run(tmp_path, gpkgs, "serial.gpkg")
+
+    for classe, disks in enumerate(layers, start=1):
+        expected = shapely.intersects(boxes[:, None], disks[None, :]).any(axis=1)
+        np.testing.assert_array_equal(
+            gdf["class_{}".format(classe)].values,
+            expected[gdf["a"].values]
+            )
+
+
+def test_coverage_counts_overlaps_once(tmp_path, gpkgs):
+    boxes, layers = gpkgs[2:]
+    gdf = run(tmp_path, gpkgs, "coverage.gpkg", coverage=True)
+    boxes = boxes[gdf["a"].values]
+
+    for classe, disks in enumerate(layers, start=1):
+        expected = shapely.area(
+            shapely.intersection(boxes, shapely.union_all(disks))
+            ) / shapely.area(boxes)
+        np.testing.assert_allclose(
+            gdf["coverage_{}".format(classe)].values,
+            expected,
+            atol=1e-9
+            )
+
+
+@pytest.mark.parametrize("kwargs", [{"workers": 2}, {"chunksize": 70}])
+def test_workers_and_chunks_match_serial(tmp_path, gpkgs, kwargs):
+    serial = run(tmp_path, gpkgs, "serial.gpkg", coverage=True, bitpacked=True)
+    other = run(tmp_path, gpkgs, "other.gpkg", coverage=True, bitpacked=True, **kwargs)
+
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(serial.drop(columns=["index", "geometry"])),
+        pd.DataFrame(other.drop(columns=["index", "geometry"]))
+        )
+    assert serial.geometry.geom_equals(other.geometry).all()
+    assert set(serial.geom_type) == set(other.geom_type) == {"MultiPolygon"}
+
+
+def test_get_intersect_matches(gpkgs):
+    boxes, layers = gpkgs[2:]
+    gdf = gpd.GeoDataFrame(geometry=boxes, index=np.arange(len(boxes)) * 2 + 1)
+    intersections = GetIntersections.__new__(GetIntersections)
+    matches = intersections.get_intersect_matches(gdf, layers[0])
+
+    expected = shapely.intersects(boxes[:, None], layers[0][None, :]).any(axis=1)
+    assert matches == gdf.index[expected].to_list()
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_at(monkeypatch, stop_name):
+    """Make get_layer_matches fail on stop_name, record computed layers."""
+    monkeypatch.undo()
+    computed = []
+    get_layer_matches = GetIntersections.get_layer_matches
+
+    def patched(self, intersecting_name, tree):
+        if intersecting_name == stop_name:
+            raise Interrupted
+        computed.append(intersecting_name)
+        return get_layer_matches(self, intersecting_name, tree)
+
+    monkeypatch.setattr(GetIntersections, "get_layer_matches", patched)
+
+    return computed
+
+
+def test_checkpoint_resume(tmp_path, gpkgs, monkeypatch):
+    expected = run(tmp_path, gpkgs, "expected.gpkg", coverage=True)
+
+    computed = interrupt_at(monkeypatch, "zone_2")
+    with pytest.raises(Interrupted):
+        run(tmp_path, gpkgs, "resumed.gpkg", coverage=True, checkpoint=True)
+    assert computed == ["zone_1"]
+    assert os.listdir(tmp_path / "resumed_checkpoints") == ["zone_1.npz"]
+
+    # Rerun: zone_1 comes from its checkpoint
+    computed = interrupt_at(monkeypatch, None)
+    gdf = run(tmp_path, gpkgs, "resumed.gpkg", coverage=True, checkpoint=True)
+    assert computed == ["zone_2", "zone_3"]
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(gdf.drop(columns="geometry")),
+        pd.DataFrame(expected.drop(columns="geometry"))
+        )
+    assert not os.path.exists(tmp_path / "resumed_checkpoints")
+
+
+def test_checkpoint_outdated(tmp_path, gpkgs, monkeypatch):
+    computed = interrupt_at(monkeypatch, "zone_3")
+    with pytest.raises(Interrupted):
+        run(tmp_path, gpkgs, "output.gpkg", checkpoint=True)
+    assert computed == ["zone_1", "zone_2"]
+
+    # Change an intersecting layer: no checkpoint can be reused
+    boxes, layers = gpkgs[2:]
+    layers[0] = shapely.buffer(layers[0], 100)
+    gpd.GeoDataFrame(
+        {"c": np.arange(len(layers[0]))},
+        geometry=layers[0],
+        crs=2154
+        ).to_file(gpkgs[1], layer="zone_1", driver="GPKG")
+
+    computed = interrupt_at(monkeypatch, None)
+    gdf = run(tmp_path, gpkgs, "output.gpkg", checkpoint=True)
+    assert sorted(computed) == ["zone_1", "zone_2", "zone_3"]
+    expected = shapely.intersects(boxes[:, None], layers[0][None, :]).any(axis=1)
+    np.testing.assert_array_equal(gdf["class_1"].values, expected[gdf["a"].values])
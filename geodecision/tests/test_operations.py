@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""Tests for `geodecision.spatialops.operations`."""
+
+import numpy as np
+import geopandas as gpd
+import shapely
+import pytest
+
+from geodecision.spatialops.operations import get_intersect_pairs
+from geodecision.spatialops.operations import repair_geometries
+
+
+def test_get_intersect_pairs():
+    rng = np.random.default_rng(0)
+    base = shapely.buffer(
+        shapely.points(rng.uniform(0, 1000, (50, 2))),
+        40,
+        quad_segs=32
+        )
+    x, y = rng.uniform(0, 1000, (2, 200))
+    boxes = shapely.box(x, y, x + 10, y + 10)
+    base_pos, boxes_pos = get_intersect_pairs(base, boxes)
+
+    expected = np.nonzero(shapely.intersects(base[:, None], boxes[None, :]))
+    assert sorted(zip(base_pos, boxes_pos)) == sorted(zip(*expected))
+    # The caller's geometries are left untouched
+    assert not shapely.is_prepared(base).any()
+    assert not shapely.is_prepared(boxes).any()
+
+
+@pytest.mark.parametrize("method", ["make_valid", "buffer"])
+def test_repair_geometries(method):
+    bowtie = shapely.Polygon([(0, 0), (10, 10), (10, 0), (0, 10), (0, 0)])
+    flat = shapely.Polygon([(0, 0), (10, 0), (20, 0), (0, 0)])
+    square = shapely.box(0, 0, 1, 1)
+    gdf = gpd.GeoDataFrame(
+        {"a": [1, 2, 3, 4]},
+        geometry=[bowtie, shapely.Polygon(), flat, square],
+        crs=2154
+        )
+    repaired = repair_geometries(gdf, method=method)
+
+    assert repaired["validity"].tolist() == [True, False, False, True]
+    assert shapely.is_valid(repaired.geometry.values[0])
+    assert repaired.geom_type[0] in ("Polygon", "MultiPolygon")
+    # buffer(0) keeps only one of the two triangles of the bowtie
+    expected = 50 if method == "make_valid" else 25
+    assert repaired.area[0] == pytest.approx(expected)
+    assert repaired.geometry.values[3] is gdf.geometry.values[3]
+    # The input is not modified
+    assert gdf.geometry.values[0] is bowtie
+    assert "validity" not in gdf.columns
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""Tests for `geodecision.graph.splittednodes`."""
+
+import numpy as np
+import geopandas as gpd
+import shapely
+import pytest
+
+from geodecision.graph.splittednodes import GetSplitNodes
+
+
+SQUARE_WITH_HOLE = shapely.Polygon(
+    [(0, 0), (100, 0), (100, 100), (0, 100), (0, 0)],
+    [[(40, 40), (60, 40), (60, 60), (40, 60), (40, 40)]]
+    )
+
+
+def reference_split(geometry, dist_split):
+    """Previous implementation: interpolate along the boundary of each part."""
+    points = []
+    for part in shapely.get_parts(geometry):
+        boundary = part.boundary
+        nb_split = int(boundary.length // dist_split)
+        if nb_split <= 2:
+            nb_split = 3
+        points.extend(
+            boundary.interpolate(i / nb_split, normalized=True)
+            for i in range(1, nb_split)
+            )
+
+    return points
+
+
+def split(geometries, dist_split, **kwargs):
+    gdf = gpd.GeoDataFrame(
+        {"id": np.arange(len(geometries))},
+        geometry=list(geometries)
+        )
+
+    return GetSplitNodes(gdf, dist_split, "id", **kwargs).get_split_nodes()
+
+
+def test_split_matches_interpolate():
+    rng = np.random.default_rng(0)
+    disks = shapely.buffer(
+        shapely.points(rng.uniform(0, 1e4, (100, 2))),
+        rng.uniform(5, 200, 100)
+        )
+    holes = shapely.buffer(shapely.centroid(disks), rng.uniform(1, 4, 100))
+    polygons = np.concatenate(
+        [shapely.difference(disks, holes), disks, [SQUARE_WITH_HOLE]]
+        )
+
+    for dist_split in (7, 25, 80):
+        points = split(polygons, dist_split)
+        expected = [reference_split(polygon, dist_split) for polygon in polygons]
+
+        np.testing.assert_array_equal(
+            points["id"].values,
+            np.repeat(np.arange(len(polygons)), [len(e) for e in expected])
+            )
+        np.testing.assert_allclose(
+            shapely.get_coordinates(points.geometry.values),
+            shapely.get_coordinates(np.concatenate(expected)),
+            atol=1e-6
+            )
+
+
+def test_split_at_ring_junction():
+    # 480 m of rings split in 6: the 5th point is at the end of the exterior
+    points = split([SQUARE_WITH_HOLE], 80)
+
+    np.testing.assert_allclose(
+        shapely.get_coordinates(points.geometry.values),
+        [[80, 0], [100, 60], [60, 100], [0, 80], [0, 0]]
+        )
+
+
+def test_split_empty_geometries():
+    points = split([None, shapely.box(0, 0, 10, 10), shapely.Polygon()], 5)
+
+    assert (points["id"] == 1).all()
+    assert len(points) == 7
+    assert points["unique_id"].tolist() == ["1_{}".format(i) for i in range(7)]
+
+
+def test_split_near_network():
+    edges = gpd.GeoDataFrame(
+        geometry=[shapely.linestrings([[-10, -5], [110, -5]])]
+        )
+    points = split([shapely.box(0, 0, 100, 100)], 10, edges=edges, threshold=10)
+    all_points = split([shapely.box(0, 0, 100, 100)], 10)
+    distances = shapely.distance(all_points.geometry.values, edges.geometry[0])
+
+    # Points of the south side (and its corners) only
+    np.testing.assert_array_equal(
+        shapely.get_coordinates(points.geometry.values),
+        shapely.get_coordinates(all_points.geometry.values[distances <= 10])
+        )
+    assert (shapely.get_coordinates(points.geometry.values)[:, 1] < 5).all()
+    assert points["unique_id"].tolist() == [
+        "0_{}".format(i) for i in range(len(points))
+        ]
+
+
+@pytest.mark.parametrize("with_edges", [True, False])
+def test_split_requires_edges_and_threshold(with_edges):
+    edges = gpd.GeoDataFrame(geometry=[shapely.linestrings([[0, 0], [1, 0]])])
+    kwargs = {"edges": edges} if with_edges else {"threshold": 10}
+    with pytest.raises(ValueError):
+        split([shapely.box(0, 0, 100, 100)], 10, **kwargs)
+
+
+def test_split_multipolygon_parts():
+    multi = shapely.MultiPolygon([SQUARE_WITH_HOLE, shapely.box(200, 0, 230, 30)])
+    points = split([shapely.box(-50, -50, -20, -20), multi], 80)
+
+    # Each part is split on its own, holes with the exterior of their part
+    assert points["id"].tolist() == [0] * 2 + [1] * 5 + [1] * 2
+    assert points["part_id"].tolist() == [0] * 2 + [0] * 5 + [1] * 2
+    xy = shapely.get_coordinates(points.geometry.values)
+    assert (xy[7:, 0] >= 200).all()
+    np.testing.assert_allclose(
+        xy[2:7],
+        shapely.get_coordinates(np.array(reference_split(SQUARE_WITH_HOLE, 80)))
+        )
+
+
+def test_split_interior_rings():
+    # The hole adds 80 m to the 400 m of exterior: one more point (with 80 m)
+    square = shapely.Polygon(SQUARE_WITH_HOLE.exterior)
+    points = split([SQUARE_WITH_HOLE, square], 80)
+    assert points["id"].tolist() == [0] * 5 + [1] * 4
+
+    # Split every 40 m, the 11th point (440 m) is on the hole
+    points = split([SQUARE_WITH_HOLE], 40)
+    on_hole = shapely.intersects(
+        points.geometry.values,
+        SQUARE_WITH_HOLE.interiors[0]
+        )
+    assert on_hole.tolist() == [False] * 10 + [True]
+    np.testing.assert_allclose(
+        shapely.get_coordinates(points.geometry.values[-1]),
+        [[60, 60]]
+        )
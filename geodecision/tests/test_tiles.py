@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""Tests for `geodecision.citygml.tiles`."""
+
+import numpy as np
+
+from geodecision.citygml.tiles import GetRoofsAndSlopesTiles
+from .test_analyseroofs import roof_ring, square_building, write_city_gml
+
+
+def test_merge_tiles(tmp_path):
+    # Same file name in two directories
+    paths = []
+    for directory, buildings in [
+            ("a", [("BU_0", 0), ("BU_1", 100), ("BU_2", 200)]),
+            ("b", [("BU_1", 100), ("BU_2", 500), ("BU_3", 300)])
+            ]:
+        (tmp_path / directory).mkdir()
+        paths.append(str(tmp_path / directory / "tile.gml"))
+        write_city_gml(
+            paths[-1],
+            [
+                square_building(
+                    building_id,
+                    roof_ring(842000.0 + offset, 6519000.0, 30.0)
+                    )
+                for building_id, offset in buildings
+                ]
+            )
+
+    tiles = GetRoofsAndSlopesTiles(paths, 2154, 2154, attributes=["nom"])
+
+    # BU_1 (tiles border) is kept once, BU_2 of the second tile is another
+    # building
+    buildings = tiles.df_buildings
+    assert sorted(buildings.index) == ["BU_0", "BU_1", "BU_2", "BU_2_1", "BU_3"]
+    assert buildings["tile_id"].to_dict() == {
+        "BU_0": 0, "BU_1": 0, "BU_2": 0, "BU_2_1": 1, "BU_3": 1
+        }
+    assert (buildings["tile"] == "tile").all()
+    for gdf in (tiles.gdf_roofs, tiles.gdf_grounds):
+        assert sorted(gdf["building_ids"]) == sorted(buildings.index)
+        np.testing.assert_array_equal(
+            gdf["tile_id"].values,
+            buildings["tile_id"].loc[gdf["building_ids"]].values
+            )
+        assert gdf["uid"].tolist() == list(range(5))
+    reused = tiles.gdf_roofs.set_index("building_ids").geometry
+    assert reused["BU_2_1"].bounds[0] == 842500.0